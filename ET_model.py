@@ -1,13 +1,27 @@
-from plotly import graph_objects as go
 import numpy as np
-import matplotlib.pyplot as plt
+from contextlib import nullcontext
+
+from rendering import downsample
 
 class ET_model():
     # Class that implements the ET model computations,
     # adds a function for inserting either effector or target cells
     # and plots the results both in a scatter and trajectory plot
 
-    def __init__(self, E, T, p, m, n, r, k, c, u, v, s, d, delta_t = 0.01):
+    # Available integrators, "euler" and "rk4" take fixed steps of delta_t,
+    # "rk45" (embedded Runge-Kutta with error control) and "bdf" (implicit,
+    # for stiff regimes) adapt their step and are interpolated onto the
+    # iteration grid
+    INTEGRATORS = ("euler", "rk4", "rk45", "bdf")
+
+    # Optional instrumentation.Instrumentation, attach one to time the phases,
+    # count the iterations and receive every iteration's (T, E) through its observer
+    instrumentation = None
+
+    def __init__(self, E, T, p, m, n, r, k, c, u, v, s, d, delta_t = 0.01, integrator = "euler", rtol = 1e-6, atol = 1e-9):
+        if integrator not in self.INTEGRATORS:
+            raise ValueError(f"Unknown integrator {integrator}, expected one of {self.INTEGRATORS}")
+
         self._E0 = E  # Initial number of effector cells (immune cells)
         self._T0 = T  # Initial number of target cells (disease cells)
         self._p = p  # Growth rate of effector cells based on target cell count
@@ -21,11 +35,15 @@ class ET_model():
         self._s = s  # Rate of effector cell self-renewal
         self._d = d  # Death rate of effector cells
         self._delta_t = delta_t # Timestep for one iteration in the model
+        self._integrator = integrator # Integration method
+        self._rtol = rtol # Relative tolerance of the adaptive integrators
+        self._atol = atol # Absolute tolerance of the adaptive integrators
+        self._rhs_evaluations = 0 # Number of right-hand side evaluations of the last observe
         self._num_of_iterations = 0 # Number of iterations
         self._T = np.array([]) # Array for T results colection
         self._E = np.array([]) # Array for E results colection
 
-    def _update(self, T_prev, E_prev):
+    def _rates(self, T_prev, E_prev):
         # Computes rates of change for T and E
         dT_dt = self._r * T_prev - self._k * T_prev * E_prev
         dE_dt = (
@@ -33,77 +51,249 @@ class ET_model():
             self._s * (E_prev**self._n / (self._c**self._n + E_prev**self._n)) -
             self._d * E_prev
         )
+        return dT_dt, dE_dt
+
+    def _rk4_rates(self, T_prev, E_prev):
+        # Classic Runge-Kutta slope over one timestep, the stage states
+        # are clamped so the Hill terms never see negative cell counts
+        half_t = self._delta_t / 2
+        dT1, dE1 = self._rates(T_prev, E_prev)
+        dT2, dE2 = self._rates(np.maximum(0, T_prev + half_t * dT1), np.maximum(0, E_prev + half_t * dE1))
+        dT3, dE3 = self._rates(np.maximum(0, T_prev + half_t * dT2), np.maximum(0, E_prev + half_t * dE2))
+        dT4, dE4 = self._rates(np.maximum(0, T_prev + self._delta_t * dT3), np.maximum(0, E_prev + self._delta_t * dE3))
+        self._rhs_evaluations += 4
+        return (dT1 + 2 * dT2 + 2 * dT3 + dT4) / 6, (dE1 + 2 * dE2 + 2 * dE3 + dE4) / 6
+
+    def _step_rates(self, T_prev, E_prev):
+        # Slope of one fixed step of the selected integrator
+        if self._integrator == "rk4":
+            return self._rk4_rates(T_prev, E_prev)
+        self._rhs_evaluations += 1
+        return self._rates(T_prev, E_prev)
+
+    def _update(self, T_prev, E_prev):
+        dT_dt, dE_dt = self._step_rates(T_prev, E_prev)
 
         # Applys updates based on timestep 
         T_next = max(0, T_prev + dT_dt * self._delta_t)
         E_next = max(0, E_prev + dE_dt * self._delta_t)
 
         return T_next, E_next
-        
-    def _prepare_modulation_schedule(self, iterations, modulation):
-        # Creates modulation arrays for E and T
-        T_modulation = np.zeros(iterations)
-        E_modulation = np.zeros(iterations)
-
-        for target, point, strength in modulation:
-            if target == "T":
-                T_modulation[point] = strength
-            elif target == "E":
-                E_modulation[point] = strength
-
-        return T_modulation, E_modulation
-    
+
+    def _clamped_rhs(self, t, y):
+        # Right-hand side for the adaptive integrators, a population
+        # that reached zero cannot decrease any further
+        y = np.maximum(0, y)
+        dy = np.array(self._rates(y[0], y[1]))
+        return np.where((y <= 0) & (dy < 0), 0, dy)
+
+    def _integrate_segment(self, y0, times):
+        # Integrates from times[0] with an adaptive integrator and interpolates
+        # the dense output onto times. Populations crossing zero are handled as
+        # terminal events, the integration restarts with them set to zero
+        from scipy.integrate import solve_ivp
+
+        method = {"rk45": "RK45", "bdf": "BDF"}[self._integrator]
+        results = np.empty((2, len(times)))
+        results[:, 0] = y0
+        filled = 1
+        t, y = times[0], np.array(y0, dtype=float)
+
+        while filled < len(times):
+            watched = np.flatnonzero(y > 0)
+            events = []
+            for species in watched:
+                event = lambda t, y, species=species: y[species]
+                event.terminal = True
+                event.direction = -1
+                events.append(event)
+
+            solution = solve_ivp(self._clamped_rhs, (t, times[-1]), y, method=method, dense_output=True,
+                                 events=events, rtol=self._rtol, atol=self._atol)
+            self._rhs_evaluations += solution.nfev
+            if solution.status == -1:
+                raise RuntimeError(f"Integration failed: {solution.message}")
+
+            end = times[-1] if solution.status == 0 else solution.t[-1]
+            reached = filled + int(np.searchsorted(times[filled:], end, side="right"))
+            if reached > filled:
+                results[:, filled:reached] = np.maximum(0, solution.sol(times[filled:reached]))
+            filled = reached
+
+            t, y = end, np.maximum(0, solution.y[:, -1])
+            for species, event_times in zip(watched, solution.t_events):
+                if len(event_times):
+                    # The population that triggered the event is exactly zero
+                    y[species] = 0
+
+        return results
+
+    def _phase(self, name):
+        # Times a phase when instrumentation is attached
+        return self.instrumentation.phase(name) if self.instrumentation is not None else nullcontext()
+
+    def _observing(self):
+        # Whether the attached instrumentation samples states, checked once per advance
+        return self.instrumentation is not None and self.instrumentation.observer is not None
+
+    def _observe_iterations(self, start, stop):
+        # Passes the stored iterations start + 1 ... stop to the observer of the attached instrumentation
+        for iteration in range(start + 1, stop + 1):
+            self.instrumentation.observe(iteration, (self._T[..., iteration], self._E[..., iteration]))
+
+    def _advance_fixed(self, T, E, start, stop):
+        # Fixed step integration from state (T, E) at iteration start,
+        # fills iterations start + 1 ... stop and passes each one to the
+        # observer as it is computed
+        if not self._observing():
+            for iteration in range(start + 1, stop + 1):
+                T, E = self._update(T, E)
+                self._T[..., iteration], self._E[..., iteration] = T, E
+            return
+        for iteration in range(start + 1, stop + 1):
+            T, E = self._update(T, E)
+            self._T[..., iteration], self._E[..., iteration] = T, E
+            self.instrumentation.observe(iteration, (T, E))
+
+    def _advance_adaptive(self, T, E, start, stop):
+        # Adaptive integration from state (T, E) at iteration start,
+        # fills iterations start + 1 ... stop. The solver runs the whole
+        # segment at once, the observer gets its iterations when it returns
+        if stop <= start:
+            return
+        times = np.arange(start, stop + 1) * self._delta_t
+        segment = self._integrate_segment([T, E], times)
+        self._T[start + 1:stop + 1], self._E[start + 1:stop + 1] = segment[:, 1:]
+        if self._observing():
+            self._observe_iterations(start, stop)
+
+    def _prepare_modulation_events(self, iterations, modulation):
+        # Creates a sorted sparse list of (iteration, T dose, E dose) events.
+        # Modulation entries are (target, point, strength) or repeated doses
+        # (target, point, strength, every, times), doses given at the same
+        # iteration accumulate. Iteration 0 is the initial state and points
+        # past the horizon are never reached, so those doses are dropped
+        doses = {}
+
+        for entry in modulation:
+            target, point, strength = entry[:3]
+            every, times = entry[3:5] if len(entry) > 3 else (1, 1)
+            if target not in ("T", "E"):
+                continue
+            first = point if point >= 1 else point + every * -((point - 1) // every)
+            last = min(point + every * (times - 1), iterations - 1)
+            for iteration in range(first, last + 1, every):
+                dose = doses.setdefault(iteration, [0.0, 0.0])
+                dose[0 if target == "T" else 1] += strength
+
+        return [(iteration, T_dose, E_dose) for iteration, (T_dose, E_dose) in sorted(doses.items())]
 
     def observe(self, iterations, modulation=[]):
         # Observing n states of the system
-        self._iterations = iterations
-        self._iterations_aray = np.arange(self._iterations)
-        self._T = np.zeros(iterations)
-        self._E = np.zeros(iterations)
-        self._T[0] = self._T0
-        self._E[0] = self._E0
-        T_modulation, E_modulation = self._prepare_modulation_schedule(iterations, modulation)
-        
-        for iteration in range(1, iterations):
-            # Planned modulation is applied based on preprepared modulation arrays
-            T_prev = max(0, self._T[iteration - 1] + T_modulation[iteration])
-            E_prev = max(0, self._E[iteration - 1] + E_modulation[iteration])
-            # And the system updates to the next state
-            self._T[iteration], self._E[iteration] = self._update(T_prev, E_prev)
-        
-        self._iterations_aray = np.arange(self._iterations)
+        with self._phase("setup"):
+            self._iterations = iterations
+            self._iterations_aray = np.arange(self._iterations)
+            self._T = np.zeros(np.shape(self._T0) + (iterations,))
+            self._E = np.zeros(np.shape(self._E0) + (iterations,))
+            self._T[..., 0] = self._T0
+            self._E[..., 0] = self._E0
+            events = self._prepare_modulation_events(iterations, modulation)
+            self._rhs_evaluations = 0
+            advance = self._advance_adaptive if self._integrator in ("rk45", "bdf") else self._advance_fixed
+
+        # The system evolves uninterrupted between events, the doses of
+        # iteration i are added to the state of iteration i - 1
+        with self._phase("stepping"):
+            T, E, start = self._T0, self._E0, 0
+            for iteration, T_dose, E_dose in events:
+                advance(T, E, start, iteration - 1)
+                T = np.maximum(0, self._T[..., iteration - 1] + T_dose)
+                E = np.maximum(0, self._E[..., iteration - 1] + E_dose)
+                start = iteration - 1
+            advance(T, E, start, iterations - 1)
+        if self.instrumentation is not None:
+            self.instrumentation.count(iterations - 1)
         
         return self._T, self._E
     
-    def plot_scatter(self):
-        # Scatter plot 
+    def _cache_key_parts(self):
+        # Configuration identifying a run for Result_Cache
+        return [np.asarray(value, dtype=float) for value in (self._E0, self._T0, self._p, self._m, self._n, self._r,
+                                                              self._k, self._c, self._u, self._v, self._s, self._d)] + [
+            self._delta_t, self._integrator, self._rtol, self._atol]
+
+    def _cache_arrays(self):
+        # Results of the last observe stored by Result_Cache
+        return {"T": self._T, "E": self._E}
 
-        fig_xy = go.Figure()
+    def _cache_restore(self, arrays):
+        # Restores results stored by Result_Cache as if observe had run
+        self._T, self._E = arrays["T"], arrays["E"]
+        self._iterations = self._T.shape[-1]
+        self._iterations_aray = np.arange(self._iterations)
+        return self._T, self._E
 
-        fig_xy.add_trace(go.Scatter(x=self._iterations_aray, y=self._E, mode='lines+markers', name='Effector cells (E)', line=dict(color='blue')))
-        fig_xy.add_trace(go.Scatter(x=self._iterations_aray, y=self._T, mode='lines+markers', name='Target cells (T)', line=dict(color='green')))
+    def plot_scatter(self, max_points = 4000):
+        # Scatter plot, plotly is only imported here. Series longer than
+        # max_points are downsampled keeping their extremes, None plots all
+        from plotly import graph_objects as go
 
-        fig_xy.update_layout(
-            title="Effector cells (E) and Target cells (T) over Iterations (Time)",
-            xaxis_title="Iterations (Time)",
-            yaxis_title="Cell counts",
-            legend_title="Cell type"
-        )
-        fig_xy.show()
+        with self._phase("plotting"):
+            fig_xy = go.Figure()
+
+            E_iterations, E = downsample(self._iterations_aray, self._E, max_points)
+            T_iterations, T = downsample(self._iterations_aray, self._T, max_points)
+            fig_xy.add_trace(go.Scatter(x=E_iterations, y=E, mode='lines+markers', name='Effector cells (E)', line=dict(color='blue')))
+            fig_xy.add_trace(go.Scatter(x=T_iterations, y=T, mode='lines+markers', name='Target cells (T)', line=dict(color='green')))
+
+            fig_xy.update_layout(
+                title="Effector cells (E) and Target cells (T) over Iterations (Time)",
+                xaxis_title="Iterations (Time)",
+                yaxis_title="Cell counts",
+                legend_title="Cell type"
+            )
+            fig_xy.show()
 
     def plot_trajectory(self):
-        # Trajectory plot
+        # Trajectory plot, matplotlib is only imported here
+        import matplotlib.pyplot as plt
 
-        plt.figure(figsize=(10, 8))
+        with self._phase("plotting"):
+            plt.figure(figsize=(10, 8))
 
-        plt.plot(self._T, self._E, label="Trajectory", color='blue')
+            plt.plot(self._T, self._E, label="Trajectory", color='blue')
         
-        plt.scatter(self._T[0], self._E[0], color='green', label='Start (T0, E0)')
-        plt.scatter(self._T[-1], self._E[-1], color='red', label='End (T, E)')
+            plt.scatter(self._T[0], self._E[0], color='green', label='Start (T0, E0)')
+            plt.scatter(self._T[-1], self._E[-1], color='red', label='End (T, E)')
         
-        plt.xlabel("Target cells (T)")
-        plt.ylabel("Effector cells (E)")
-        plt.title("Phase plane trajectory")
-        plt.legend()
-        plt.grid()
-        plt.show()
\ No newline at end of file
+            plt.xlabel("Target cells (T)")
+            plt.ylabel("Effector cells (E)")
+            plt.title("Phase plane trajectory")
+            plt.legend()
+            plt.grid()
+            plt.show()
+
+
+class ET_ensemble(ET_model):
+    # Class that runs many ET models with different parameters and initial
+    # conditions in lockstep. Every argument can be a scalar or an array, they
+    # are broadcast against each other and each element is one ensemble member.
+    # The same modulation is applied to every member and observe returns
+    # (members, iterations) arrays
+
+    # Fixed step integrators only, adaptive steps would be shared by all members
+    INTEGRATORS = ("euler", "rk4")
+
+    def __init__(self, E, T, p, m, n, r, k, c, u, v, s, d, delta_t = 0.01, integrator = "euler"):
+        arrays = np.broadcast_arrays(*[np.asarray(value, dtype=float) for value in (E, T, p, m, n, r, k, c, u, v, s, d)])
+        super().__init__(*[array.ravel() for array in arrays], delta_t=delta_t, integrator=integrator)
+        self._members = self._E0.size # Number of ensemble members
+
+    def _update(self, T_prev, E_prev):
+        # Same step as ET_model with the clamp applied to whole vectors
+        dT_dt, dE_dt = self._step_rates(T_prev, E_prev)
+
+        T_next = np.maximum(0, T_prev + dT_dt * self._delta_t)
+        E_next = np.maximum(0, E_prev + dE_dt * self._delta_t)
+
+        return T_next, E_next
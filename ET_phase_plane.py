@@ -0,0 +1,207 @@
+import numpy as np
+
+
+class ET_phase_plane():
+    # Class that scans the phase plane of an ET_model. A whole grid of (T0, E0)
+    # initial conditions is integrated at once as NumPy arrays with the model's
+    # own step, every point is classified by the fixed point it converges to,
+    # fixed points come from the analytic nullclines and are characterised by
+    # the eigenvalues of the analytic Jacobian
+
+    ESCAPE = -1 # Basin label of trajectories whose target cells escape control
+    UNRESOLVED = -2 # Basin label of trajectories that did not settle in time
+
+    def __init__(self, model):
+        self._model = model
+
+    def _dE_terms(self, T, E):
+        # Parts of dE/dt that depend only on T (stimulation) and only on E
+        model = self._model
+        stimulation = model._p * ((T**model._u) / (model._m**model._v + T**model._v))
+        self_regulation = model._s * (E**model._n / (model._c**model._n + E**model._n)) - model._d * E
+        return stimulation, self_regulation
+
+    def _invert_stimulation(self, level, T_max, samples=4096):
+        # Solves p T^u / (m^v + T^v) = level for T > 0. For u == v the inverse
+        # is closed form, otherwise roots are bracketed on a T grid and refined
+        # by bisection, all levels at once
+        model = self._model
+        level = np.atleast_1d(np.asarray(level, dtype=float))
+
+        if model._u == model._v:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                ratio = level / (model._p - level)
+                T = model._m * ratio ** (1 / model._v)
+            T = np.where((level > 0) & (level < model._p), T, np.nan)
+            return [T[i:i + 1][np.isfinite(T[i:i + 1])] for i in range(len(level))]
+
+        T_grid = np.linspace(0, T_max, samples)[1:]
+        stimulation, _ = self._dE_terms(T_grid, 0.0)
+        roots = []
+        for value in level:
+            difference = stimulation - value
+            brackets = np.flatnonzero(np.sign(difference[:-1]) * np.sign(difference[1:]) < 0)
+            low, high = T_grid[brackets], T_grid[brackets + 1]
+            for _ in range(60):
+                middle = (low + high) / 2
+                below = (self._dE_terms(middle, 0.0)[0] - value) * (self._dE_terms(low, 0.0)[0] - value) > 0
+                low, high = np.where(below, middle, low), np.where(below, high, middle)
+            roots.append((low + high) / 2)
+        return roots
+
+    def nullclines(self, T_max, E_max, samples=512):
+        # T-nullclines are T = 0 and E = r / k, the E-nullcline dE/dt = 0 is
+        # returned as T(E) points: p T^u / (m^v + T^v) = d E - s E^n / (c^n + E^n)
+        model = self._model
+        E = np.linspace(0, E_max, samples)
+        _, self_regulation = self._dE_terms(0.0, E)
+        T_points, E_points = [], []
+        for E_value, roots in zip(E, self._invert_stimulation(-self_regulation, T_max)):
+            T_points.extend(roots)
+            E_points.extend([E_value] * len(roots))
+
+        return {
+            "T_nullcline_E": model._r / model._k,
+            "E_nullcline_T": np.asarray(T_points),
+            "E_nullcline_E": np.asarray(E_points),
+        }
+
+    def jacobian(self, T, E):
+        # Analytic Jacobian of the right-hand side of ET_model._rates
+        model = self._model
+        with np.errstate(divide="ignore", invalid="ignore"):
+            denominator_T = model._m**model._v + T**model._v
+            dstimulation_dT = model._p * (
+                model._u * T**(model._u - 1) * denominator_T - T**model._u * model._v * T**(model._v - 1)
+            ) / denominator_T**2
+            dregulation_dE = model._s * model._n * E**(model._n - 1) * model._c**model._n / (model._c**model._n + E**model._n)**2
+        dstimulation_dT = np.nan_to_num(dstimulation_dT, nan=0.0)
+        dregulation_dE = np.nan_to_num(dregulation_dE, nan=0.0)
+
+        return np.array([
+            [model._r - model._k * E, -model._k * T],
+            [dstimulation_dT, dregulation_dE - model._d],
+        ])
+
+    def _classify_fixed_point(self, eigenvalues):
+        real = eigenvalues.real
+        if np.all(real < 0):
+            return "stable focus" if np.any(eigenvalues.imag != 0) else "stable node"
+        if np.all(real > 0):
+            return "unstable focus" if np.any(eigenvalues.imag != 0) else "unstable node"
+        if np.any(real > 0) and np.any(real < 0):
+            return "saddle"
+        return "non-hyperbolic"
+
+    def fixed_points(self, T_max, E_max, samples=8192):
+        # Intersections of the nullclines: tumour free points (T = 0) where the
+        # E self-regulation vanishes, and coexistence points on E = r / k
+        model = self._model
+        points = [(0.0, 0.0)]
+
+        # T = 0: s E^n / (c^n + E^n) = d E, roots of the E self-regulation for E > 0
+        E_grid = np.linspace(0, E_max, samples)[1:]
+        regulation = self._dE_terms(0.0, E_grid)[1] / E_grid
+        for bracket in np.flatnonzero(np.sign(regulation[:-1]) * np.sign(regulation[1:]) < 0):
+            low, high = E_grid[bracket], E_grid[bracket + 1]
+            for _ in range(60):
+                middle = (low + high) / 2
+                same_sign = np.sign(self._dE_terms(0.0, middle)[1]) == np.sign(self._dE_terms(0.0, low)[1])
+                low, high = (middle, high) if same_sign else (low, middle)
+            points.append((0.0, (low + high) / 2))
+
+        # E = r / k: the stimulation has to balance the E self-regulation
+        E_star = model._r / model._k
+        level = -self._dE_terms(0.0, E_star)[1]
+        for T_star in self._invert_stimulation(level, T_max)[0]:
+            points.append((float(T_star), E_star))
+
+        fixed_points = []
+        for T, E in points:
+            eigenvalues = np.linalg.eigvals(self.jacobian(T, E))
+            fixed_points.append({
+                "T": T,
+                "E": E,
+                "eigenvalues": eigenvalues,
+                "stability": self._classify_fixed_point(eigenvalues),
+            })
+        return fixed_points
+
+    def scan(self, T_range, E_range, resolution=(1000, 1000), iterations=20000, check_every=100,
+             tolerance=1e-6, escape_factor=10.0):
+        # Integrates the (nE, nT) grid of initial conditions in lockstep with the
+        # model's fixed step. Every check_every steps members that settled
+        # (relative rate below tolerance) or escaped (T above escape_factor times
+        # the scanned range) are retired, so the work shrinks as the scan
+        # converges. Returns the basin map of fixed point indices, ESCAPE or
+        # UNRESOLVED labels, together with the fixed points and nullclines
+        model = self._model
+        T0 = np.linspace(T_range[0], T_range[1], resolution[0])
+        E0 = np.linspace(E_range[0], E_range[1], resolution[1])
+        T_grid, E_grid = np.meshgrid(T0, E0)
+        T_max, E_max = escape_factor * T_range[1], escape_factor * E_range[1]
+
+        T = T_grid.ravel().copy()
+        E = E_grid.ravel().copy()
+        members = np.arange(T.size)
+        final_T = np.full(T.size, np.nan)
+        final_E = np.full(T.size, np.nan)
+        basins = np.full(T.size, self.UNRESOLVED)
+
+        for iteration in range(1, iterations + 1):
+            dT_dt, dE_dt = model._step_rates(T, E)
+            T = np.maximum(0, T + dT_dt * model._delta_t)
+            E = np.maximum(0, E + dE_dt * model._delta_t)
+
+            if iteration % check_every and iteration != iterations:
+                continue
+
+            dT_dt, dE_dt = model._rates(T, E)
+            settled = (np.abs(dT_dt) / (1 + T) < tolerance) & (np.abs(dE_dt) / (1 + E) < tolerance)
+            escaped = T > T_max
+            retired = settled | escaped | (iteration == iterations)
+            final_T[members[retired]] = T[retired]
+            final_E[members[retired]] = E[retired]
+            basins[members[escaped]] = self.ESCAPE
+            keep = ~retired
+            T, E, members = T[keep], E[keep], members[keep]
+            if members.size == 0:
+                break
+
+        fixed_points = self.fixed_points(T_max, E_max)
+        labelled = basins != self.ESCAPE
+        scale = np.array([1 + T_range[1], 1 + E_range[1]])
+        points = np.array([[point["T"], point["E"]] for point in fixed_points])
+        distances = np.hypot((final_T[labelled, None] - points[None, :, 0]) / scale[0],
+                             (final_E[labelled, None] - points[None, :, 1]) / scale[1])
+        nearest = distances.argmin(axis=1)
+        close = distances[np.arange(nearest.size), nearest] < 1e-3
+        basins[labelled] = np.where(close, nearest, self.UNRESOLVED)
+
+        return {
+            "T0": T0,
+            "E0": E0,
+            "basins": basins.reshape(T_grid.shape),
+            "final_T": final_T.reshape(T_grid.shape),
+            "final_E": final_E.reshape(T_grid.shape),
+            "fixed_points": fixed_points,
+            "nullclines": self.nullclines(T_max, E_max),
+        }
+
+    def plot_basins(self, scan):
+        # Basin map with the fixed points on top
+        import matplotlib.pyplot as plt
+
+        plt.figure(figsize=(10, 8))
+        plt.imshow(scan["basins"], origin="lower", aspect="auto", cmap="tab10", interpolation="nearest",
+                   extent=(scan["T0"][0], scan["T0"][-1], scan["E0"][0], scan["E0"][-1]))
+        plt.colorbar(label="Basin (fixed point index, -1 escape, -2 unresolved)")
+        for index, point in enumerate(scan["fixed_points"]):
+            plt.scatter(point["T"], point["E"], color="black")
+            plt.annotate(f"{index}: {point['stability']}", (point["T"], point["E"]))
+        plt.xlim(scan["T0"][0], scan["T0"][-1])
+        plt.ylim(scan["E0"][0], scan["E0"][-1])
+        plt.xlabel("Initial target cells (T0)")
+        plt.ylabel("Initial effector cells (E0)")
+        plt.title("Basins of attraction")
+        plt.show()
@@ -0,0 +1,176 @@
+import numpy as np
+
+from ET_model import ET_model
+
+
+class ET_stochastic(ET_model):
+    # Class that runs the ET model as a stochastic process on integer cell
+    # counts. The rates of _rates are split into four reactions,
+    #   T birth        r T                                  T + 1
+    #   T kill         k T E                                T - 1
+    #   E production   p T^u / (m^v + T^v) + s E^n / (c^n + E^n)   E + 1
+    #   E death        d E                                  E - 1
+    # and all realizations advance together as NumPy arrays. Modulation works
+    # as in ET_model, observe returns (realizations, iterations) arrays sampled
+    # every delta_t and the time at which the target cells died out is kept
+    # for every realization
+
+    # "tau_leap" fires Poisson numbers of reactions over adaptively chosen leaps
+    # and falls back to exact steps when a leap would be shorter than a few
+    # reactions, "ssa" is Gillespie's exact direct method for every realization
+    INTEGRATORS = ("tau_leap", "ssa")
+
+    CHANGES = np.array([[1, -1, 0, 0], [0, 0, 1, -1]]) # Change of (T, E) by each reaction
+
+    def __init__(self, E, T, p, m, n, r, k, c, u, v, s, d, delta_t = 0.01, integrator = "tau_leap",
+                 realizations = 1000, epsilon = 0.03, critical = 10, seed = None):
+        E, T = np.broadcast_arrays(np.rint(np.asarray(E, dtype=float)), np.rint(np.asarray(T, dtype=float)))
+        E, T = np.broadcast_to(E, (realizations,)), np.broadcast_to(T, (realizations,))
+        super().__init__(E.copy(), T.copy(), p, m, n, r, k, c, u, v, s, d, delta_t=delta_t, integrator=integrator)
+        self._realizations = realizations # Number of independent realizations
+        self._epsilon = epsilon # Allowed relative change of the propensities during one leap
+        self._critical = critical # A leap shorter than this many expected reactions is replaced by exact steps
+        self._seed = seed # Seed of the random generator
+        self._rng = np.random.default_rng(seed)
+        self._extinction_time = np.full(realizations, np.nan) # Time the target cells died out, NaN while alive
+
+    def _propensities(self, T, E):
+        # Propensities of the four reactions, shape (4, realizations)
+        stimulation = self._p * ((T**self._u) / (self._m**self._v + T**self._v))
+        self_renewal = self._s * (E**self._n / (self._c**self._n + E**self._n))
+        return np.stack([self._r * T, self._k * T * E, stimulation + self_renewal, self._d * E])
+
+    def _leap_size(self, T, E, propensities):
+        # Leap bound of Cao, Gillespie and Petzold (2006), the expected change
+        # and the variance of every population stay within epsilon of its size
+        mean = self.CHANGES @ propensities
+        variance = np.abs(self.CHANGES) @ propensities
+        bound = np.maximum(self._epsilon * np.stack([T, E]) / 2, 1)
+        with np.errstate(divide="ignore"):
+            tau = np.minimum(bound / np.abs(mean), bound**2 / variance)
+        return tau.min(axis=0)
+
+    def _ssa_step(self, T, E, propensities, total, horizon):
+        # One exact step of the direct method. A realization whose next reaction
+        # falls past its horizon only moves its clock, the waiting time is
+        # memoryless so this does not bias the process
+        with np.errstate(divide="ignore"):
+            wait = self._rng.exponential(1.0, len(total)) / total
+        fire = wait < horizon
+        choice = self._rng.random(len(total)) * total
+        reaction = (choice[None, :] >= np.cumsum(propensities, axis=0)).sum(axis=0)
+        reaction = np.minimum(reaction, 3)
+        T = T + np.where(fire, self.CHANGES[0, reaction], 0)
+        E = E + np.where(fire, self.CHANGES[1, reaction], 0)
+        return T, E, np.minimum(wait, horizon)
+
+    def _leap(self, T, E, propensities, tau):
+        # Poisson leap, leaps that would make a population negative are
+        # halved and redrawn
+        T_next, E_next = T.copy(), E.copy()
+        pending = np.arange(len(T))
+        while len(pending):
+            fired = self._rng.poisson(propensities[:, pending] * tau[pending])
+            change = self.CHANGES @ fired
+            T_next[pending] = T[pending] + change[0]
+            E_next[pending] = E[pending] + change[1]
+            rejected = (T_next[pending] < 0) | (E_next[pending] < 0)
+            pending = pending[rejected]
+            tau[pending] /= 2
+        return T_next, E_next, tau
+
+    def _advance_fixed(self, T, E, start, stop):
+        # Stochastic replacement of the fixed step integration, advances every
+        # realization from iteration start to stop. Steps never pass the next
+        # sampling time so each step records at most one iteration. An
+        # iteration is passed to the observer once every realization has
+        # reached it
+        T, E = np.rint(np.asarray(T, dtype=float)), np.rint(np.asarray(E, dtype=float))
+        self._extinction_time[T > 0] = np.nan
+        time = np.full(self._realizations, start * self._delta_t)
+        next_iteration = np.full(self._realizations, start + 1)
+
+        observing, observed = self._observing(), start
+        active = np.flatnonzero(next_iteration <= stop)
+        while len(active):
+            T_active, E_active, time_active = T[active], E[active], time[active]
+            sample_time = next_iteration[active] * self._delta_t
+            horizon = sample_time - time_active
+
+            propensities = self._propensities(T_active, E_active)
+            total = propensities.sum(axis=0)
+            self._rhs_evaluations += len(active)
+
+            if self._integrator == "ssa":
+                exact = np.ones(len(active), dtype=bool)
+            else:
+                tau = np.minimum(self._leap_size(T_active, E_active, propensities), horizon)
+                exact = tau * total < self._critical
+
+            T_next, E_next, step = T_active.copy(), E_active.copy(), np.empty(len(active))
+            if exact.any():
+                T_next[exact], E_next[exact], step[exact] = self._ssa_step(
+                    T_active[exact], E_active[exact], propensities[:, exact], total[exact], horizon[exact])
+            if not exact.all():
+                leaping = ~exact
+                T_next[leaping], E_next[leaping], step[leaping] = self._leap(
+                    T_active[leaping], E_active[leaping], propensities[:, leaping], tau[leaping])
+
+            died = (T_active > 0) & (T_next == 0)
+            self._extinction_time[active[died]] = time_active[died] + step[died]
+
+            reached = step >= horizon
+            time[active] = np.where(reached, sample_time, time_active + step)
+            T[active], E[active] = T_next, E_next
+            sampled = active[reached]
+            self._T[sampled, next_iteration[sampled]] = T[sampled]
+            self._E[sampled, next_iteration[sampled]] = E[sampled]
+            next_iteration[sampled] += 1
+
+            active = active[next_iteration[active] <= stop]
+            if observing:
+                complete = int(next_iteration.min()) - 1
+                self._observe_iterations(observed, complete)
+                observed = complete
+
+    def observe(self, iterations, modulation=[]):
+        # Observing n states of every realization, the random generator is
+        # reseeded so repeated observes give the same realizations
+        self._rng = np.random.default_rng(self._seed)
+        self._extinction_time = np.where(self._T0 > 0, np.nan, 0.0)
+        return super().observe(iterations, modulation)
+
+    def extinction_probability(self):
+        # Fraction of realizations whose target cells are extinct at the end
+        return float(np.mean(self._T[:, -1] == 0))
+
+    def extinction_curve(self):
+        # Fraction of realizations with no target cells at every iteration
+        return np.mean(self._T == 0, axis=0)
+
+    def extinction_times(self, bins = 50):
+        # Distribution of the time to extinction over the realizations that
+        # ended extinct, returns the times and their histogram
+        times = self._extinction_time[np.isfinite(self._extinction_time) & (self._T[:, -1] == 0)]
+        horizon = (self._iterations - 1) * self._delta_t
+        counts, edges = np.histogram(times, bins=bins, range=(0, horizon))
+        return {
+            "times": times,
+            "mean": float(times.mean()) if len(times) else np.nan,
+            "median": float(np.median(times)) if len(times) else np.nan,
+            "counts": counts,
+            "edges": edges,
+        }
+
+    def _cache_key_parts(self):
+        # Configuration identifying a run for Result_Cache
+        return super()._cache_key_parts() + [self._realizations, self._epsilon, self._critical, self._seed]
+
+    def _cache_arrays(self):
+        # Results of the last observe stored by Result_Cache
+        return {"T": self._T, "E": self._E, "extinction_time": self._extinction_time}
+
+    def _cache_restore(self, arrays):
+        # Restores results stored by Result_Cache as if observe had run
+        self._extinction_time = arrays["extinction_time"]
+        return super()._cache_restore(arrays)
@@ -1,73 +1,123 @@
-iterations = 20
-n0 = 10
-
-def observe(n0):
-
-    n1 = n0/2
-    n2 = n1/3
-    n3 = n2*6
-    return n1, n2, n3
-
-n1s = []
-n2s = []
-n3s = []
-
-for _ in range(iterations):
-    n1, n2, n3 = observe(n0)
-    n3 = n0
-    n1s.append(n1)
-    n2s.append(n2)
-    n3s.append(n3)
-
-
-print(n1s, n2s, n3s)
-
-
-values = []
-def observe(n0):
-
-    n1 = -0.3 * n0
-    n2 = 0.2 * n1
-    n3 = 0.02 * n2
-    n4 = 2 * n3
-    return n1, n2, n3, n4
-
-for _ in range(iterations):
-    n1, n2, n3, n4 = observe(n0)
-    
-    values.append([n1, n2, n3, n4])
-
-    n0 = n4  
- 
-print(values)
-
-
-from plotly import graph_objects as go
-def _plot_scatter(results):
-    #scatter plot výsledků
-    E_values = [res[0] for res in results]
-    T_values = [res[1] for res in results]
-    g_values = [res[2] for res in results]
-    h_values = [res[3] for res in results]
-    iterations = list(range(1, len(results)))
-    fig_xy = go.Figure()
-    fig_xy.add_trace(go.Scatter(x=iterations, y=E_values, mode='lines+markers', name='Effector Cells (E)', line=dict(color='blue')))
-    fig_xy.add_trace(go.Scatter(x=iterations, y=T_values, mode='lines+markers', name='Target Cells (T)', line=dict(color='green')))
-    fig_xy.add_trace(go.Scatter(x=iterations, y=g_values, mode='lines+markers', name='Target Cells (T)', line=dict(color='yellow')))
-    fig_xy.add_trace(go.Scatter(x=iterations, y=h_values, mode='lines+markers', name='Target Cells (T)', line=dict(color='red')))
-    fig_xy.update_layout(
-        title="Effector Cells (E) and Target Cells (T) Over Time",
-        xaxis_title="Iterations (Time)",
-        yaxis_title="Cell Counts",
-        legend_title="Cell Type"
-    )
-    fig_xy.show()
-
-
-
-
-
-
-
-
-_plot_scatter(values)
\ No newline at end of file
+import numpy as np
+
+
+class Linear_Compartment_Model():
+    # Class that implements a linear compartment model x(t + 1) = M x(t)
+    # with a configurable transfer matrix M. The state after k steps is
+    # computed by repeated squaring of M in O(log k) matrix products and whole
+    # trajectories are filled as one array by doubling. The transfer matrix
+    # can be batched, (..., n, n), to run many coefficient sets at once
+
+    def __init__(self, transfer, labels = None):
+        self._transfer = np.asarray(transfer, dtype=float)
+        if self._transfer.ndim < 2 or self._transfer.shape[-1] != self._transfer.shape[-2]:
+            raise ValueError(f"Transfer matrix must be square, got shape {self._transfer.shape}")
+        self._size = self._transfer.shape[-1] # Number of compartments
+        self._labels = labels if labels is not None else [f"n{i}" for i in range(self._size)]
+        self._results = np.array([]) # Trajectory of the last observe, (..., steps + 1, n)
+
+    @classmethod
+    def from_chain(cls, coefficients, feedback = -1):
+        # Builds the model of a chain n1 = c1 n0, n2 = c2 n1, ... evaluated once
+        # per iteration, the compartment at index feedback (of n1 ... nK) becomes
+        # n0 of the next iteration, None keeps n0 constant. The state is
+        # (n0, n1, ..., nK) and coefficients can be batched, (..., K)
+        coefficients = np.asarray(coefficients, dtype=float)
+        links = coefficients.shape[-1]
+        gains = np.cumprod(coefficients, axis=-1) # n_i in units of n0
+        transfer = np.zeros(coefficients.shape[:-1] + (links + 1, links + 1))
+
+        # n0 of the next iteration and the chain recomputed from it
+        source = 0 if feedback is None else np.arange(1, links + 1)[feedback]
+        transfer[..., 0, source] = 1
+        transfer[..., 1:, source] = gains
+
+        model = cls(transfer, labels=[f"n{i}" for i in range(links + 1)])
+        model._gains = gains
+        return model
+
+    def chain_state(self, n0):
+        # Initial state of a chain model, n0 and the chain evaluated from it
+        n0 = np.asarray(n0, dtype=float)
+        return np.concatenate([np.broadcast_to(n0[..., None], self._gains.shape[:-1] + (1,)),
+                               self._gains * n0[..., None]], axis=-1)
+
+    def _check_steps(self, steps):
+        # Number of steps as a non-negative int
+        if int(steps) != steps or steps < 0:
+            raise ValueError(f"Number of steps must be a non-negative integer, got {steps}")
+        return int(steps)
+
+    def matrix_power(self, steps):
+        # M^steps by repeated squaring, O(log steps) matrix products
+        steps = self._check_steps(steps)
+        result = np.broadcast_to(np.eye(self._size), self._transfer.shape).copy()
+        power = self._transfer
+        while steps:
+            if steps & 1:
+                result = result @ power
+            steps >>= 1
+            if steps:
+                power = power @ power
+        return result
+
+    def state(self, steps, initial_state):
+        # State after steps iterations without computing the ones in between
+        return (self.matrix_power(steps) @ np.asarray(initial_state, dtype=float)[..., None])[..., 0]
+
+    def observe(self, steps, initial_state):
+        # Trajectory x(0) ... x(steps) as one (..., steps + 1, n) array. Rows
+        # [L, 2L) are rows [0, L) advanced by M^L, so the trajectory doubles
+        # with every product and M^L doubles with it
+        steps = self._check_steps(steps)
+        initial_state = np.asarray(initial_state, dtype=float)
+        batch = np.broadcast_shapes(self._transfer.shape[:-2], initial_state.shape[:-1])
+        results = np.empty(batch + (steps + 1, self._size))
+        results[..., 0, :] = initial_state
+
+        power = np.swapaxes(self._transfer, -1, -2) # Transposed, rows are multiplied from the left
+        filled = 1
+        while filled < steps + 1:
+            count = min(filled, steps + 1 - filled)
+            np.matmul(results[..., :count, :], power, out=results[..., filled:filled + count, :])
+            filled += count
+            if filled < steps + 1:
+                power = power @ power
+
+        self._results = results
+        return results
+
+    def plot_scatter(self, compartments = None):
+        # Scatter plot of the last trajectory
+        from plotly import graph_objects as go
+
+        compartments = range(self._size) if compartments is None else compartments
+        iterations = np.arange(self._results.shape[-2])
+        fig_xy = go.Figure()
+        for compartment in compartments:
+            fig_xy.add_trace(go.Scatter(x=iterations, y=self._results[..., compartment], mode='lines+markers',
+                                        name=self._labels[compartment]))
+        fig_xy.update_layout(
+            title="Compartments over iterations",
+            xaxis_title="Iterations (Time)",
+            yaxis_title="Cell counts",
+            legend_title="Compartment"
+        )
+        fig_xy.show()
+
+
+if __name__ == "__main__":
+    iterations = 20
+    n0 = 10
+
+    # n1 = n0 / 2, n2 = n1 / 3, n3 = 6 n2 with n0 held constant
+    model = Linear_Compartment_Model.from_chain([1 / 2, 1 / 3, 6], feedback=None)
+    results = model.observe(iterations - 1, model.chain_state(n0))
+    print(results[:, 1], results[:, 2], results[:, 0])
+
+    # n1 = -0.3 n0, n2 = 0.2 n1, n3 = 0.02 n2, n4 = 2 n3 fed back as n0
+    model = Linear_Compartment_Model.from_chain([-0.3, 0.2, 0.02, 2])
+    results = model.observe(iterations - 1, model.chain_state(n0))
+    print(results[:, 1:].tolist())
+
+    model.plot_scatter(compartments=range(1, 5))
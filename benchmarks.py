@@ -0,0 +1,233 @@
+import os
+
+# Plots are never shown by the benchmarks, matplotlib has to work without a display
+os.environ["MPLBACKEND"] = "Agg"
+
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(ROOT, "term_project"))
+
+# Benchmark suite for every model and engine of the repository. Each case is
+# run at several sizes, reports model steps per second (best of repeats) and
+# the tracemalloc peak of one extra run, results are written as JSON and can be
+# compared against a baseline JSON of an earlier run to flag regressions.
+#
+#   python benchmarks.py --output results.json
+#   python benchmarks.py --baseline results.json --tolerance 0.25
+#
+# The baseline is machine specific, record it on the machine that compares.
+
+ET_PARAMETERS = dict(E=300, T=500, p=1.0, m=20.0, n=2, r=0.5, k=0.002, c=100.0, u=1, v=1, s=50.0, d=0.2)
+
+
+def _meca(engine, epochs, cells, **options):
+    from cellular_automata_meca import Meca_Cellular_Automata
+    automaton = Meca_Cellular_Automata(epochs, cells, engine=engine, rng=np.random.default_rng(0), **options)
+    return lambda: automaton._evolve_rule(30), epochs
+
+
+def _meca_batched(epochs, cells):
+    from cellular_automata_meca import Meca_Cellular_Automata
+    automaton = Meca_Cellular_Automata(epochs, cells, engine="batched", rng=np.random.default_rng(0))
+    return lambda: automaton._evolve_all_rules_n_times_batched(epochs, automaton._intial_grid), 256 * epochs
+
+
+def _meca_ensemble(rules, conditions, epochs, cells, workers):
+    from cellular_automata_ensemble import Meca_Ensemble
+    ensemble = Meca_Ensemble(list(range(rules)), conditions, epochs, cells, seed=0, workers=workers)
+    return ensemble.run, rules * conditions * epochs
+
+
+def _automaton(epochs, cells):
+    from cellular_automata import Cellular_Automaton
+    automaton = Cellular_Automaton(30)
+    grid = automaton.random_grid(cells, np.random.default_rng(0))
+    return lambda: automaton.evolve(epochs, grid), epochs
+
+
+def _automaton_2d(epochs, size):
+    from cellular_automata_2d import Cellular_Automaton_2D
+    automaton = Cellular_Automaton_2D("B3/S23")
+    grid = np.random.default_rng(0).integers(0, 2, (size, size), dtype=np.uint8)
+    return lambda: automaton.evolve(epochs, grid), epochs
+
+
+def _et(integrator, iterations):
+    from ET_model import ET_model
+    model = ET_model(**ET_PARAMETERS, integrator=integrator)
+    return lambda: model.observe(iterations), iterations
+
+
+def _et_ensemble(members, iterations):
+    from ET_model import ET_ensemble
+    parameters = dict(ET_PARAMETERS, T=np.linspace(1, 1000, members))
+    model = ET_ensemble(**parameters)
+    return lambda: model.observe(iterations), members * iterations
+
+
+def _et_stochastic(integrator, realizations, iterations):
+    from ET_stochastic import ET_stochastic
+    model = ET_stochastic(**ET_PARAMETERS, delta_t=0.1, integrator=integrator, realizations=realizations, seed=0)
+    return lambda: model.observe(iterations), realizations * iterations
+
+
+def _alzheimer(integrator, end_time):
+    from alzheimer_model import AlzheimerModel
+    project = os.path.join(ROOT, "term_project")
+    model = AlzheimerModel(os.path.join(project, "params.yaml"), os.path.join(project, "intial_state.yaml"),
+                           end_time=end_time, integrator=integrator)
+    initial_state = model.get_state()
+
+    def run():
+        model.set_state(initial_state)
+        model.simulate()
+
+    return run, int(model.steps)
+
+
+def _compartments(batch, steps):
+    from basic_model_of_immunity import Linear_Compartment_Model
+    coefficients = np.random.default_rng(0).uniform(0.5, 1.0, (batch, 4))
+    model = Linear_Compartment_Model.from_chain(coefficients)
+    initial_state = model.chain_state(np.ones(batch))
+    return lambda: model.observe(steps, initial_state), batch * steps
+
+
+def benchmark_cases(quick=False):
+    # (name, parameters, setup) of every case, setup returns the function to
+    # time and the number of model steps it performs
+    sizes = (lambda small, large: small) if quick else (lambda small, large: large)
+    cases = []
+
+    for cells in sizes((64,), (128, 512)):
+        cases.append(("meca_python", dict(epochs=100, cells=cells), lambda cells=cells: _meca("python", 100, cells)))
+    for engine in ("numpy", "memory"):
+        for cells, epochs in sizes(((256, 200),), ((1024, 1000), (16384, 1000))):
+            cases.append((f"meca_{engine}", dict(epochs=epochs, cells=cells),
+                          lambda engine=engine, epochs=epochs, cells=cells: _meca(engine, epochs, cells, memory_depth=3)))
+    for cells, epochs in sizes(((256, 100),), ((256, 1000), (2048, 1000))):
+        cases.append(("meca_batched", dict(epochs=epochs, cells=cells),
+                      lambda epochs=epochs, cells=cells: _meca_batched(epochs, cells)))
+    # Serial, two workers and one worker per core, the pool start-up is part of the timing
+    for workers in sorted({1, 2, os.cpu_count() or 1}):
+        for conditions in sizes((8,), (16, 128)):
+            cases.append(("meca_ensemble", dict(rules=8, conditions=conditions, epochs=200, cells=256, workers=workers),
+                          lambda conditions=conditions, workers=workers: _meca_ensemble(8, conditions, 200, 256, workers)))
+    for cells in sizes((1024,), (4096, 65536)):
+        cases.append(("automaton_1d", dict(epochs=500, cells=cells), lambda cells=cells: _automaton(500, cells)))
+    for size in sizes((128,), (256, 1024)):
+        cases.append(("automaton_2d", dict(epochs=50, size=size), lambda size=size: _automaton_2d(50, size)))
+    for integrator in ("euler", "rk4", "rk45", "bdf"):
+        for iterations in sizes((1000,), (10000, 100000)):
+            cases.append((f"et_{integrator}", dict(iterations=iterations),
+                          lambda integrator=integrator, iterations=iterations: _et(integrator, iterations)))
+    for members in sizes((100,), (1000, 10000)):
+        cases.append(("et_ensemble", dict(members=members, iterations=1000),
+                      lambda members=members: _et_ensemble(members, 1000)))
+    for integrator, largest in (("tau_leap", 10000), ("ssa", 1000)):
+        for realizations in sizes((100,), (largest // 10, largest)):
+            cases.append((f"et_stochastic_{integrator}", dict(realizations=realizations, iterations=100),
+                          lambda integrator=integrator, realizations=realizations: _et_stochastic(integrator, realizations, 100)))
+    for integrator in ("euler", "rk4", "rk45", "bdf"):
+        for end_time in sizes((100,), (1000, 100000)):
+            if integrator in ("rk45", "bdf") and end_time > 1000:
+                continue
+            cases.append((f"alzheimer_{integrator}", dict(end_time=end_time),
+                          lambda integrator=integrator, end_time=end_time: _alzheimer(integrator, end_time)))
+    for batch, steps in sizes(((100, 1000),), ((1, 1000000), (10000, 1000))):
+        cases.append(("compartments", dict(batch=batch, steps=steps),
+                      lambda batch=batch, steps=steps: _compartments(batch, steps)))
+
+    return cases
+
+
+def measure(setup, repeats=3):
+    # Best wall time of repeats runs and the tracemalloc peak of one more run
+    run, steps = setup()
+    run() # Warm up, lazy imports and caches are not part of the measurement
+
+    seconds = min(_timed(run) for _ in range(repeats))
+
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {"steps": steps, "seconds": seconds, "steps_per_second": steps / seconds, "peak_memory_bytes": peak}
+
+
+def _timed(run):
+    start = time.perf_counter()
+    run()
+    return time.perf_counter() - start
+
+
+def case_key(result):
+    # Identifies a case across runs, its name and sizes
+    return result["name"] + json.dumps(result["parameters"], sort_keys=True)
+
+
+def compare(results, baseline, tolerance):
+    # Cases that are slower or use more memory than the baseline by more than
+    # the tolerance, as (key, metric, baseline value, current value)
+    previous = {case_key(result): result for result in baseline["results"]}
+    regressions = []
+    for result in results:
+        reference = previous.get(case_key(result))
+        if reference is None:
+            continue
+        if result["steps_per_second"] < reference["steps_per_second"] * (1 - tolerance):
+            regressions.append((case_key(result), "steps_per_second", reference["steps_per_second"], result["steps_per_second"]))
+        if result["peak_memory_bytes"] > reference["peak_memory_bytes"] * (1 + tolerance):
+            regressions.append((case_key(result), "peak_memory_bytes", reference["peak_memory_bytes"], result["peak_memory_bytes"]))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks of all models and engines")
+    parser.add_argument("--quick", action="store_true", help="small sizes only, for a fast check")
+    parser.add_argument("--filter", default="", help="run only cases whose name contains this text")
+    parser.add_argument("--repeats", type=int, default=3, help="timed runs per case, the best is reported")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative slowdown or memory growth")
+    args = parser.parse_args(argv)
+
+    results = []
+    for name, parameters, setup in benchmark_cases(args.quick):
+        if args.filter not in name:
+            continue
+        result = dict(name=name, parameters=parameters, **measure(setup, args.repeats))
+        results.append(result)
+        print(f"{name:28} {json.dumps(parameters):52} {result['steps_per_second']:14.4g} steps/s "
+              f"{result['peak_memory_bytes'] / 2**20:10.2f} MiB", flush=True)
+
+    report = {
+        "machine": {"platform": platform.platform(), "python": platform.python_version(),
+                    "numpy": np.__version__, "cpus": os.cpu_count()},
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        for key, metric, reference, current in regressions:
+            print(f"REGRESSION {key} {metric}: {reference:.4g} -> {current:.4g}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
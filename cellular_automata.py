@@ -1,7 +1,11 @@
 import random
-import matplotlib.pyplot as plt
+from contextlib import nullcontext
+from functools import lru_cache
+
 import numpy as np
 
+from cellular_automata_observables import observe_generations
+from rendering import block_reduce
 
 
 # Rule 90
@@ -63,50 +67,207 @@ value_grid = {0:0, 1:1, 2:0, 3:1, 4:1, 5:0, 6:1, 7:1}
 
 
 
+# generalized engine
+
+# Class that evolves a 1D cellular automaton with arbitrary neighborhood offsets,
+# a k-state alphabet and a table, totalistic or outer totalistic rule. The rule
+# is compiled once into index weights and a lookup table, one step is then a
+# weighted sum of shifted grids mapped through the table with np.take
+class Cellular_Automaton:
+    RULE_TYPES = ("table", "totalistic", "outer_totalistic")
+    # Offset of the cell itself
+    CENTER = 0
+    # Optional instrumentation.Instrumentation, attach one to time the phases,
+    # count the epochs and receive every generation through its observer
+    instrumentation = None
+
+    # offsets: neighbor positions relative to the cell, grid[i + offset], the
+    #   first offset is the most significant digit of a table rule index
+    # states: size of the alphabet k
+    # rule: Wolfram style code (int), a sequence or a {index: state} dict.
+    #   table rules are indexed by the neighborhood read as a base k number,
+    #   totalistic rules by the neighborhood sum and outer totalistic rules by
+    #   center state * (max outer sum + 1) + sum of the other neighbors
+    def __init__(self, rule, offsets=(-1, 0, 1), states=2, rule_type="table"):
+        if rule_type not in self.RULE_TYPES:
+            raise ValueError(f"Unknown rule type {rule_type}, expected one of {self.RULE_TYPES}")
+        if rule_type == "outer_totalistic" and self.CENTER not in offsets:
+            raise ValueError("Outer totalistic rules need the cell itself (offset 0) in the neighborhood")
+
+        self._offsets = tuple(offsets)
+        self._states = states
+        self._rule_type = rule_type
+        self._dtype = np.uint8 if states <= 256 else np.uint16
+        self._weights, self._lookup_table = self._compile_rule(rule)
+
+    # Builds the index weights of every offset and the lookup table
+    def _compile_rule(self, rule):
+        n = len(self._offsets)
+        k = self._states
+
+        if self._rule_type == "table":
+            weights = [k ** (n - 1 - j) for j in range(n)]
+        elif self._rule_type == "totalistic":
+            weights = [1] * n
+        else:
+            outer_sums = (k - 1) * (n - 1) + 1
+            weights = [outer_sums if offset == self.CENTER else 1 for offset in self._offsets]
+
+        table_size = sum(weight * (k - 1) for weight in weights) + 1
+
+        if isinstance(rule, dict):
+            missing = set(range(table_size)) - set(rule)
+            if missing:
+                raise ValueError(f"Rule is missing entries for indices {sorted(missing)}")
+            lookup_table = [rule[index] for index in range(table_size)]
+        elif isinstance(rule, (int, np.integer)):
+            rule = int(rule)
+            if not 0 <= rule < k ** table_size:
+                raise ValueError(f"Rule code must be in [0, {k ** table_size})")
+            lookup_table = [(rule // k ** index) % k for index in range(table_size)]
+        else:
+            lookup_table = list(np.ravel(rule))
+            if len(lookup_table) != table_size:
+                raise ValueError(f"Rule must have {table_size} entries, got {len(lookup_table)}")
+
+        lookup_table = np.asarray(lookup_table)
+        if lookup_table.min() < 0 or lookup_table.max() >= k:
+            raise ValueError(f"Rule outputs must be states in [0, {k})")
+
+        index_dtype = np.min_scalar_type(table_size - 1)
+        return np.asarray(weights, dtype=index_dtype), lookup_table.astype(self._dtype)
+
+    # Evolve grid from state t to state t+1, written into out when given. The
+    # grid is converted to the state dtype once, the index sums stay in its dtype
+    def step(self, grid, out=None):
+        grid = np.asarray(grid, dtype=self._dtype)
+        index = np.zeros(grid.shape, dtype=self._weights.dtype)
+        for offset, weight in zip(self._offsets, self._weights):
+            neighbor = np.roll(grid, -offset) if offset else grid
+            index += neighbor.astype(index.dtype) * weight if weight != 1 else neighbor
+        return np.take(self._lookup_table, index, out=out)
+
+    # Times a phase when instrumentation is attached
+    def _phase(self, name):
+        return self.instrumentation.phase(name) if self.instrumentation is not None else nullcontext()
+
+    # Iterate evolution n times into a preallocated (epochs + 1, N) array.
+    # Instrumentation is looked up once, a detached run calls no hook per epoch
+    def evolve(self, epochs, grid):
+        with self._phase("setup"):
+            results = np.empty((epochs + 1, len(grid)), dtype=self._dtype)
+            results[0] = grid
+        instrumentation = self.instrumentation
+        with self._phase("stepping"):
+            if instrumentation is None:
+                for epoch in range(1, epochs + 1):
+                    self.step(results[epoch - 1], out=results[epoch])
+            else:
+                for epoch in range(1, epochs + 1):
+                    self.step(results[epoch - 1], out=results[epoch])
+                    instrumentation.observe(epoch, results[epoch])
+                instrumentation.count(epochs)
+        return results
+
+    # Steps buffers[0] epochs times alternating between the two buffers and
+    # yields each generation. Instrumentation is looked up once, a detached
+    # run enters no phase and calls no hook per epoch
+    def _iterate_buffers(self, epochs, buffers):
+        yield buffers[0]
+        instrumentation = self.instrumentation
+        if instrumentation is None:
+            for epoch in range(1, epochs + 1):
+                self.step(buffers[(epoch - 1) % 2], out=buffers[epoch % 2])
+                yield buffers[epoch % 2]
+            return
+        for epoch in range(1, epochs + 1):
+            with instrumentation.phase("stepping"):
+                self.step(buffers[(epoch - 1) % 2], out=buffers[epoch % 2])
+            instrumentation.count(1)
+            instrumentation.observe(epoch, buffers[epoch % 2])
+            yield buffers[epoch % 2]
+
+    # Iterate evolution n times yielding each generation, only two generations
+    # are kept, the yielded array is reused so copy it to keep it
+    def iterate(self, epochs, grid):
+        buffer = np.empty((2, len(grid)), dtype=self._dtype)
+        buffer[0] = grid
+        yield from self._iterate_buffers(epochs, buffer)
+
+    # Iterate evolution n times reducing each generation through the observers
+    def observe(self, epochs, grid, observers=None):
+        return observe_generations(self.iterate(epochs, grid), observers)
+
+    # Random initial grid drawn from the numpy Generator
+    def random_grid(self, length, rng=None):
+        rng = np.random.default_rng() if rng is None else rng
+        return rng.integers(0, self._states, size=length, dtype=self._dtype)
+
+    # Visualize the evolution of the grid, matplotlib is only imported here.
+    # Grids larger than max_shape are block reduced to mean states
+    def plot(self, results, title="Evolution of Cellular Automaton", xlabel="Cell Index", ylabel="Epoch",
+             max_shape=(1000, 1500)):
+        import matplotlib.pyplot as plt
+
+        with self._phase("plotting"):
+            image = block_reduce(results, max_shape)
+            plt.figure(figsize=(15, 10))
+            plt.imshow(image, cmap='binary', interpolation='nearest', aspect='auto', vmin=0, vmax=self._states - 1,
+                       extent=(-0.5, results.shape[1] - 0.5, results.shape[0] - 0.5, -0.5))
+            plt.colorbar(label=f"State (0 - {self._states - 1})" if image is results else "Mean state")
+            plt.xlabel(xlabel)
+            plt.ylabel(ylabel)
+            plt.title(title)
+            plt.show()
+
+
 # numpy implemntation
 
-entry_grid = np.array([random.randint(0, 1) for _ in range(500)])
+# The functions below keep the original interface, neighbors at distance 2
+# with the left neighbor (grid[i + 2]) as the most significant bit
 
-def convert_to_binary_compare(input_list, value_grid):
-    binary_str = ''.join(['1' if bit else '0' for bit in input_list])
+@lru_cache(maxsize=None)
+def _compiled_automaton(value_grid_items):
+    return Cellular_Automaton(dict(value_grid_items), offsets=(2, 0, -2))
 
-    binary_int = int(binary_str, 2)
+def _automaton_for(value_grid):
+    return _compiled_automaton(tuple(sorted(value_grid.items())))
 
-    if binary_int in value_grid:
-        result = value_grid[binary_int]
+def convert_to_binary_compare(input_list, value_grid):
+    binary_int = 0
+    for bit in input_list:
+        binary_int = (binary_int << 1) | int(bool(bit))
 
-    return result
+    return value_grid[binary_int]
 
 
 # evolve grid from state t to state t+1
 def evolve_grid_numpy(value_grid, entry_grid):
-    left_neighbors = np.roll(entry_grid, -2)
-    right_neighbors = np.roll(entry_grid, 2)
-
-    new_grid = np.array([
-        convert_to_binary_compare([left_neighbors[i], entry_grid[i], right_neighbors[i]], value_grid)
-        for i in range(len(entry_grid))
-    ])
-
-    return new_grid
+    return _automaton_for(value_grid).step(np.asarray(entry_grid))
 
 # iterate evolution n times
 def evolve_grid_n_times_numpy(epochs, value_grid, entry_grid):
-    results = [entry_grid]  
-    for _ in range(epochs):
-        entry_grid = evolve_grid_numpy(value_grid, entry_grid)
-        results.append(entry_grid)  
-    return np.array(results) 
+    return _automaton_for(value_grid).evolve(epochs, np.asarray(entry_grid))
+
+# iterate evolution n times yielding each generation, only the current one is kept
+def iter_grid_evolution_numpy(epochs, value_grid, entry_grid):
+    return _automaton_for(value_grid).iterate(epochs, np.asarray(entry_grid))
+
+# iterate evolution n times reducing each generation through the observers
+# instead of storing it, returns {observer name: (epochs + 1,) array}
+def observe_grid_evolution_numpy(epochs, value_grid, entry_grid, observers=None):
+    return observe_generations(iter_grid_evolution_numpy(epochs, value_grid, entry_grid), observers)
+
 
+if __name__ == "__main__":
+    entry_grid = np.array([random.randint(0, 1) for _ in range(500)])
 
-results = evolve_grid_n_times_numpy(500, value_grid, entry_grid)
+    # The int64 grid steps like the python lookup of every neighborhood
+    expected = [convert_to_binary_compare((entry_grid[(i + 2) % len(entry_grid)], entry_grid[i], entry_grid[i - 2]),
+                                          value_grid) for i in range(len(entry_grid))]
+    assert np.array_equal(evolve_grid_numpy(value_grid, entry_grid), expected)
 
+    results = evolve_grid_n_times_numpy(500, value_grid, entry_grid)
 
-# Visualize the evolution of the grid
-plt.figure(figsize=(15, 10))
-plt.imshow(results, cmap='binary', interpolation='nearest', aspect='auto')
-plt.colorbar(label="State (0 or 1)")
-plt.xlabel("Cell Index")
-plt.ylabel("Epoch")
-plt.title("Evolution of Cellular Automaton")
-plt.show()
+    # Visualize the evolution of the grid
+    _automaton_for(value_grid).plot(results)
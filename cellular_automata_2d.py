@@ -0,0 +1,153 @@
+import re
+
+import numpy as np
+
+from cellular_automata import Cellular_Automaton
+
+
+# Pairs of (target, source) slices that add np.roll(source, shift) into target
+# along an axis of length n without allocating the rolled copy
+def _roll_slices(shift, n):
+    shift %= n
+    if shift == 0:
+        return [(slice(None), slice(None))]
+    return [(slice(shift, n), slice(0, n - shift)), (slice(0, shift), slice(n - shift, n))]
+
+
+# out += np.roll(source, (shift_y, shift_x), axis=(0, 1)), in place
+def _add_rolled(source, shift_y, shift_x, out):
+    rows, columns = source.shape
+    for target_y, source_y in _roll_slices(shift_y, rows):
+        for target_x, source_x in _roll_slices(shift_x, columns):
+            target = out[target_y, target_x]
+            np.add(target, source[source_y, source_x], out=target)
+
+
+# Class that evolves a 2D cellular automaton on a periodic lattice. Rules are
+# compiled into the same index weights and lookup table as the 1D engine, the
+# neighborhood index is built from in place shifted sums (separable for Moore
+# neighborhoods) and two state buffers are swapped every step, so stepping
+# allocates no new arrays
+class Cellular_Automaton_2D(Cellular_Automaton):
+    RULE_TYPES = Cellular_Automaton.RULE_TYPES + ("life_like",)
+    NEIGHBORHOODS = ("moore", "von_neumann")
+    CENTER = (0, 0)
+    # Cells mapped through the lookup table at once, np.take needs platform
+    # integer indices and converting the whole lattice would allocate each step
+    LOOKUP_CHUNK = 1 << 20
+
+    # rule: as in Cellular_Automaton, or a "B3/S23" string for life like rules
+    def __init__(self, rule, neighborhood="moore", radius=1, states=2, rule_type="life_like"):
+        if neighborhood not in self.NEIGHBORHOODS:
+            raise ValueError(f"Unknown neighborhood {neighborhood}, expected one of {self.NEIGHBORHOODS}")
+
+        self._neighborhood = neighborhood
+        self._radius = radius
+        offsets = self._neighborhood_offsets(neighborhood, radius)
+
+        if rule_type == "life_like":
+            if states != 2:
+                raise ValueError("Life like rules are defined for 2 states")
+            rule = self._parse_life_like(rule, len(offsets) - 1)
+            rule_type = "outer_totalistic"
+
+        super().__init__(rule, offsets, states, rule_type)
+        self._workspace_shape = None
+
+    # Row major (dy, dx) offsets of the neighborhood including the cell itself
+    def _neighborhood_offsets(self, neighborhood, radius):
+        span = range(-radius, radius + 1)
+        if neighborhood == "moore":
+            return [(dy, dx) for dy in span for dx in span]
+        return [(dy, dx) for dy in span for dx in span if abs(dy) + abs(dx) <= radius]
+
+    # Outer totalistic lookup table of a "B../S.." rule, born and survive counts
+    def _parse_life_like(self, rule, number_of_neighbors):
+        match = re.fullmatch(r"B(\d*)/S(\d*)", rule.upper())
+        if match is None:
+            raise ValueError(f"Life like rule must look like B3/S23, got {rule}")
+        born = {int(count) for count in match.group(1)}
+        survive = {int(count) for count in match.group(2)}
+        return ([int(count in born) for count in range(number_of_neighbors + 1)] +
+                [int(count in survive) for count in range(number_of_neighbors + 1)])
+
+    # Scratch arrays reused by every step on lattices of the same shape
+    def _workspace(self, shape):
+        if self._workspace_shape != shape:
+            self._index = np.empty(shape, dtype=self._weights.dtype)
+            self._scratch = np.empty(shape, dtype=self._weights.dtype)
+            self._lookup_rows = max(1, self.LOOKUP_CHUNK // shape[1])
+            self._lookup_index = np.empty((self._lookup_rows, shape[1]), dtype=np.intp)
+            self._workspace_shape = shape
+        return self._index, self._scratch
+
+    # Sum of the states over the whole neighborhood (cell included) into out
+    def _neighborhood_sum(self, grid, out, scratch):
+        out.fill(0)
+        if self._neighborhood == "moore":
+            # Separable box sum, along the rows first and then along the columns
+            scratch.fill(0)
+            for shift in range(-self._radius, self._radius + 1):
+                _add_rolled(grid, 0, shift, scratch)
+            for shift in range(-self._radius, self._radius + 1):
+                _add_rolled(scratch, shift, 0, out)
+        else:
+            for dy, dx in self._offsets:
+                _add_rolled(grid, -dy, -dx, out)
+        return out
+
+    # Evolve grid from state t to state t+1, written into out when given. The
+    # grid is converted to the state dtype once so the in place sums accept it
+    def step(self, grid, out=None):
+        grid = np.asarray(grid, dtype=self._dtype)
+        index, scratch = self._workspace(grid.shape)
+
+        if self._rule_type == "table":
+            index.fill(0)
+            for (dy, dx), weight in zip(self._offsets, self._weights):
+                np.multiply(grid, weight, out=scratch)
+                _add_rolled(scratch, -dy, -dx, index)
+        else:
+            self._neighborhood_sum(grid, index, scratch)
+            if self._rule_type == "outer_totalistic":
+                # center * center weight + outer sum = center * (center weight - 1) + full sum
+                center_weight = self._weights[self._offsets.index(self.CENTER)]
+                np.multiply(grid, center_weight - 1, out=scratch)
+                np.add(index, scratch, out=index)
+
+        if out is None:
+            out = np.empty(grid.shape, dtype=self._dtype)
+        for start in range(0, grid.shape[0], self._lookup_rows):
+            rows = slice(start, start + self._lookup_rows)
+            lookup_index = self._lookup_index[:index[rows].shape[0]]
+            np.copyto(lookup_index, index[rows])
+            np.take(self._lookup_table, lookup_index, out=out[rows], mode="clip")
+        return out
+
+    # Iterate evolution n times yielding each generation from two swapped
+    # buffers, the yielded array is reused so copy it to keep it
+    def iterate(self, epochs, grid):
+        buffers = np.empty((2,) + grid.shape, dtype=self._dtype)
+        buffers[0] = grid
+        yield from self._iterate_buffers(epochs, buffers)
+
+    # Iterate evolution n times in place, only the final lattice is returned
+    # since the history of large lattices does not fit in memory
+    def evolve(self, epochs, grid):
+        for generation in self.iterate(epochs, grid):
+            pass
+        return generation.copy()
+
+    # Visualize one lattice, matplotlib is only imported here
+    def plot(self, grid, title="Cellular Automaton lattice", xlabel="Column", ylabel="Row", max_shape=(1000, 1000)):
+        super().plot(grid, title, xlabel, ylabel, max_shape)
+
+
+if __name__ == "__main__":
+    automaton = Cellular_Automaton_2D("B3/S23")
+    lattice = np.random.default_rng().integers(0, 2, (256, 256))
+
+    # An int64 lattice evolves like its uint8 copy
+    assert np.array_equal(automaton.evolve(100, lattice), automaton.evolve(100, lattice.astype(np.uint8)))
+
+    automaton.plot(automaton.evolve(100, lattice))
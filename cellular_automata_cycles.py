@@ -0,0 +1,79 @@
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+
+
+# Class that detects when the automaton revisits a state. States are hashed
+# into a table bounded to max_states entries, the oldest are dropped first, so
+# cycles longer than max_states are not reported
+class Cycle_Detector:
+    def __init__(self, max_states=4096):
+        self._max_states = max_states
+        self._seen = OrderedDict()
+
+    # Hashes the state of the given epoch, returns the epoch it was first seen
+    # at when the state repeats, otherwise None
+    def update(self, epoch, *grids):
+        digest = hashlib.blake2b(digest_size=16)
+        for grid in grids:
+            digest.update(np.packbits(grid).tobytes())
+        key = digest.digest()
+
+        first_epoch = self._seen.get(key)
+        if first_epoch is not None:
+            return first_epoch
+
+        self._seen[key] = epoch
+        if len(self._seen) > self._max_states:
+            self._seen.popitem(last=False)
+        return None
+
+
+# Spacetime diagram whose tail repeats with the detected cycle. Only the
+# computed prefix is stored, later generations are taken from the cycle when
+# indexed and the full array is built only when converted with np.asarray
+class Cyclic_Results:
+    def __init__(self, prefix, transient, period, length):
+        self._prefix = prefix
+        self._transient = transient
+        self._period = period
+        self._length = length
+        self.shape = (length,) + prefix.shape[1:]
+        self.dtype = prefix.dtype
+
+    def __len__(self):
+        return self._length
+
+    # Generation indices inside the stored prefix
+    def _source_index(self, epochs):
+        cycled = self._transient + (epochs - self._transient) % max(self._period, 1)
+        return np.where(epochs < len(self._prefix), epochs, cycled)
+
+    # Indexes like the full (epochs, N) array, the first entry of a tuple key
+    # selects epochs and the rest is applied to the selected rows
+    def __getitem__(self, item):
+        if isinstance(item, tuple):
+            if any(entry is Ellipsis or entry is None for entry in item):
+                return np.asarray(self)[item]
+            rows = self[item[0]] if item else self[:]
+            if np.ndim(rows) < len(self.shape):
+                return rows[item[1:]]
+            return rows[(slice(None),) + item[1:]]
+
+        epochs = np.arange(self._length)[item]
+        return self._prefix[self._source_index(epochs)]
+
+    def __array__(self, dtype=None, copy=None):
+        results = self[:]
+        return results if dtype is None else results.astype(dtype)
+
+
+# Rough automatic classification from the transient length and period
+def classify_cycle(cycle):
+    if cycle is None:
+        return "no cycle detected"
+    transient, period = cycle
+    if period == 1:
+        return "fixed point"
+    return "periodic"
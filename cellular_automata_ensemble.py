@@ -0,0 +1,83 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from cellular_automata_meca import Meca_Cellular_Automata
+
+
+# Evolves one (rule, initial condition) job and writes the spacetime diagram
+# straight into the shared result buffer, so nothing large is pickled back
+def _run_ensemble_job(job):
+    shm_name, shape, rule_index, rule_number, condition_index, seed_sequence, number_of_epochs = job
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        results = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+        meca = Meca_Cellular_Automata(number_of_epochs, shape[-1], engine="numpy",
+                                      rng=np.random.default_rng(seed_sequence))
+        meca._evolve_grid_n_times_numpy(number_of_epochs, meca._intial_grid,
+                                        meca._generate_rule_table(rule_number),
+                                        out=results[rule_index, condition_index])
+        # The view has to be released before the shared block can be closed
+        del results
+    finally:
+        shm.close()
+    return rule_index, condition_index
+
+
+# Class that runs a rule set over many random initial conditions in a process pool
+class Meca_Ensemble:
+    def __init__(self, rule_numbers, number_of_initial_conditions, number_of_epochs, len_initial_grid,
+                 seed=None, workers=None):
+
+        self._rule_numbers = list(rule_numbers)
+        self._number_of_initial_conditions = number_of_initial_conditions
+        self._number_of_epochs = number_of_epochs
+        self._len_initial_grid = len_initial_grid
+        self._seed = seed
+        self._workers = workers or os.cpu_count()
+        self._results = None
+
+    # Independent random streams, one per initial condition. Every rule is run
+    # on the same initial conditions, so results are comparable across rules
+    # and do not depend on the number of workers
+    def _spawn_seed_sequences(self):
+        return np.random.SeedSequence(self._seed).spawn(self._number_of_initial_conditions)
+
+    # Runs all (rule, initial condition) jobs and returns a
+    # (rules, initial conditions, epochs + 1, N) uint8 array
+    def run(self):
+        shape = (len(self._rule_numbers), self._number_of_initial_conditions,
+                 self._number_of_epochs + 1, self._len_initial_grid)
+        seed_sequences = self._spawn_seed_sequences()
+        shm = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)), 1))
+        try:
+            jobs = [
+                (shm.name, shape, rule_index, rule_number, condition_index, seed_sequence, self._number_of_epochs)
+                for rule_index, rule_number in enumerate(self._rule_numbers)
+                for condition_index, seed_sequence in enumerate(seed_sequences)
+            ]
+            if self._workers == 1:
+                for job in jobs:
+                    _run_ensemble_job(job)
+            else:
+                chunksize = max(1, len(jobs) // (4 * self._workers))
+                with ProcessPoolExecutor(max_workers=self._workers) as executor:
+                    for _ in executor.map(_run_ensemble_job, jobs, chunksize=chunksize):
+                        pass
+
+            shared_results = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+            self._results = shared_results.copy()
+            del shared_results
+        finally:
+            shm.close()
+            shm.unlink()
+
+        return self._results
+
+    # Fraction of live cells of every run at every epoch, shape (rules, initial conditions, epochs + 1)
+    def density(self):
+        if self._results is None:
+            raise RuntimeError("Ensemble must be run prior to computing statistics")
+        return self._results.mean(axis=-1)
@@ -1,20 +1,70 @@
 import numpy as np
-import pandas as pd
 import random
-import matplotlib.pyplot as plt
+from contextlib import nullcontext
+
+from cellular_automata_cycles import Cycle_Detector, Cyclic_Results, classify_cycle
+from cellular_automata_memory import Memory_Ring_Buffer
+from cellular_automata_observables import observe_generations
+from cellular_automata_store import Spacetime_Store
+from rendering import block_reduce, write_rule_atlas
 
 
 # Class that simulates and visualises the Meca automaton
 class Meca_Cellular_Automata:
-    def __init__(self, number_of_epochs, len_initial_grid
-                ):
+    # Available step engines, "python" is the original per cell implementation,
+    # "numpy" evolves the whole row at once through a lookup table, "batched"
+    # evolves all 256 rules together when the whole rule space is simulated and
+    # "memory" applies the rule to a trait state combined from the last
+    # memory_depth generations
+    ENGINES = ("python", "numpy", "batched", "memory")
+
+    # Lookup tables of all 256 elementary rules, row r holds the output of rule r
+    # for every 3-bit neighborhood index
+    RULE_TABLES = ((np.arange(256, dtype=np.uint16)[:, None] >> np.arange(8)) & 1).astype(np.uint8)
+
+    # Optional instrumentation.Instrumentation, attach one to time the phases,
+    # count the epochs and receive every solved rule through its observer.
+    # Observation is per rule, not per generation, the step is the rule number
+    # and the state all of its grids once the rule is solved (after the single
+    # stepping phase of the batched engine), use _observe_rule for generations
+    instrumentation = None
+
+    def __init__(self, number_of_epochs, len_initial_grid, engine="python", rng=None,
+                 store_path=None, detect_cycles=False, stop_at_cycle=False, max_cycle_states=4096,
+                 memory_depth=1, memory_combine="majority", memory_factor=1.0):
         
+        if engine not in self.ENGINES:
+            raise ValueError(f"Unknown engine {engine}, expected one of {self.ENGINES}")
+        if detect_cycles and engine not in ("numpy", "batched"):
+            raise ValueError("Cycle detection needs the numpy or batched engine")
+        if stop_at_cycle and not detect_cycles:
+            raise ValueError("Stopping at a cycle needs detect_cycles=True")
+        if memory_combine not in Memory_Ring_Buffer.COMBINES:
+            raise ValueError(f"Unknown memory combine {memory_combine}, expected one of {Memory_Ring_Buffer.COMBINES}")
+
         self._number_of_epochs = number_of_epochs
+        self._engine = engine
+        self._rng = rng
         self._intial_grid = self._create_initial_grid(len_initial_grid)
         self._all_results = {}
+        # Optional on-disk store, solved grids are written there instead of _all_results
+        self._store = Spacetime_Store(store_path) if store_path is not None else None
+        # Optional cycle detection, (transient, period) of every solved rule
+        # or None when no cycle was found
+        self._detect_cycles = detect_cycles
+        self._stop_at_cycle = stop_at_cycle
+        self._max_cycle_states = max_cycle_states
+        self._cycles = {}
+        # Memory settings of the "memory" engine
+        self._memory_depth = memory_depth
+        self._memory_combine = memory_combine
+        self._memory_factor = memory_factor
 
-    # Creates random intial grid to evolve of the selected length
+    # Creates random intial grid to evolve of the selected length, drawn from
+    # the numpy Generator when one was passed to the constructor
     def _create_initial_grid(self, len_initial_grid):
+        if self._rng is not None:
+            return self._rng.integers(0, 2, size=len_initial_grid, dtype=np.uint8)
         return np.array([random.randint(0, 1) for _ in range(len_initial_grid)])
     
     # Generate the value grid for rule
@@ -27,6 +77,9 @@ class Meca_Cellular_Automata:
         binary_int = (input_list[0] << 2) | (input_list[1] << 1) | input_list[2]
         return value_grid[binary_int]
 
+    # Lookup table of the rule indexed by the 3-bit neighborhood index
+    def _generate_rule_table(self, rule_number):
+        return self.RULE_TABLES[rule_number]
 
     # Evolve grid from state t to state t+1
     def _evolve_grid_meca(self, value_grid, prev_grid, curr_grid):
@@ -54,37 +107,221 @@ class Meca_Cellular_Automata:
 
         return results
 
-    # Visualize the evolution of the grid
-    def _plot_binary_map(self, results, rule_number):
-        plt.figure(figsize=(15, 10))
-        plt.imshow(results, cmap='binary', interpolation='nearest', aspect='auto')
-        plt.colorbar(label="State (0 or 1)")
-        plt.xlabel("Cell Index")
-        plt.ylabel("Epoch")
+    # Evolve grid from state t to state t+1 for the whole row at once, the new
+    # generation is written into out
+    def _evolve_grid_meca_numpy(self, rule_table, prev_grid, out):
+        neighborhood = np.roll(prev_grid, -1) << 2
+        neighborhood |= prev_grid << 1
+        neighborhood |= np.roll(prev_grid, 1)
+        np.take(rule_table, neighborhood, out=out)
+        return out
+
+    # Iterate through the grid evolution n-times, generations are stored in
+    # a preallocated (epochs + 1, N) uint8 array or written into out
+    def _evolve_grid_n_times_numpy(self, epochs, intial_grid, rule_table, out=None):
+        results = np.empty((epochs + 1, len(intial_grid)), dtype=np.uint8) if out is None else out
+        results[0] = intial_grid
+
+        # Same one step memory lag as _evolve_grid_n_times_meca, generation t
+        # is computed from generation t - 2
+        for epoch in range(1, epochs + 1):
+            self._evolve_grid_meca_numpy(rule_table, results[max(epoch - 2, 0)], results[epoch])
+
+        return results
+
+    # Iterate through the grid evolution n-times with configurable memory, the
+    # rule is applied to the trait state combined from the last memory_depth
+    # generations kept in a ring buffer
+    def _evolve_grid_n_times_memory(self, epochs, intial_grid, rule_table):
+        results = np.empty((epochs + 1, len(intial_grid)), dtype=np.uint8)
+        results[0] = intial_grid
+        memory = Memory_Ring_Buffer(self._memory_depth, len(intial_grid),
+                                    self._memory_combine, self._memory_factor)
+        memory.push(results[0])
+        trait = np.empty(len(intial_grid), dtype=np.uint8)
+
+        for epoch in range(1, epochs + 1):
+            self._evolve_grid_meca_numpy(rule_table, memory.trait(trait), results[epoch])
+            memory.push(results[epoch])
+
+        return results
+
+    # Iterate through the grid evolution n-times while hashing every state.
+    # Because of the memory lag the state at epoch t is the pair of generations
+    # (t - 1, t). Returns the results and (transient, period) of the cycle or
+    # None, when stopping early the rest of the results is filled lazily
+    def _evolve_grid_n_times_numpy_cycles(self, epochs, intial_grid, rule_table):
+        results = np.empty((epochs + 1, len(intial_grid)), dtype=np.uint8)
+        results[0] = intial_grid
+        detector = Cycle_Detector(self._max_cycle_states)
+        detector.update(0, results[0], results[0])
+        cycle = None
+
+        for epoch in range(1, epochs + 1):
+            self._evolve_grid_meca_numpy(rule_table, results[max(epoch - 2, 0)], results[epoch])
+            if cycle is not None:
+                continue
+
+            first_epoch = detector.update(epoch, results[epoch - 1], results[epoch])
+            if first_epoch is None:
+                continue
+
+            # Generations repeat with the period from generation first_epoch - 1 on
+            cycle = (max(first_epoch - 1, 0), epoch - first_epoch)
+            if self._stop_at_cycle:
+                return Cyclic_Results(results[:epoch + 1], cycle[0], cycle[1], epochs + 1), cycle
+
+        return results, cycle
+
+    # Yields the generations one by one without keeping the history, only the
+    # last three generations live in a small rotating buffer (generation t is
+    # computed from t - 2). With the "memory" engine the rule is applied to the
+    # trait state of the ring buffer as in _evolve_grid_n_times_memory. The
+    # yielded array is reused, copy it to keep it
+    def _iterate_generations(self, epochs, intial_grid, rule_table):
+        buffer = np.empty((3, len(intial_grid)), dtype=np.uint8)
+        buffer[0] = intial_grid
+
+        if self._engine == "memory":
+            memory = Memory_Ring_Buffer(self._memory_depth, len(intial_grid),
+                                        self._memory_combine, self._memory_factor)
+            memory.push(buffer[0])
+            trait = np.empty(len(intial_grid), dtype=np.uint8)
+            yield buffer[0]
+
+            for epoch in range(1, epochs + 1):
+                self._evolve_grid_meca_numpy(rule_table, memory.trait(trait), buffer[epoch % 3])
+                memory.push(buffer[epoch % 3])
+                yield buffer[epoch % 3]
+            return
+
+        yield buffer[0]
+
+        for epoch in range(1, epochs + 1):
+            prev_grid = buffer[max(epoch - 2, 0) % 3]
+            yield self._evolve_grid_meca_numpy(rule_table, prev_grid, buffer[epoch % 3])
+
+    # Evolves the rule without storing generations and reduces each of them
+    # through the observers, returns {observer name: (epochs + 1,) array}
+    def _observe_rule(self, rule_number, observers=None, epochs=None):
+        epochs = self._number_of_epochs if epochs is None else epochs
+        rule_table = self._generate_rule_table(rule_number)
+        generations = self._iterate_generations(epochs, self._intial_grid, rule_table)
+        return observe_generations(generations, observers)
+
+    # Iterate the grid evolution n-times for all 256 rules at once, row r of
+    # the (256, N) state is advanced through row r of the (256, 8) rule table
+    def _evolve_all_rules_n_times_batched(self, epochs, intial_grid):
+        results = np.empty((256, epochs + 1, len(intial_grid)), dtype=np.uint8)
+        results[:, 0] = intial_grid
+        rule_rows = np.arange(256)[:, None]
+
+        for epoch in range(1, epochs + 1):
+            prev_grid = results[:, max(epoch - 2, 0)]
+            neighborhood = np.roll(prev_grid, -1, axis=1) << 2
+            neighborhood |= prev_grid << 1
+            neighborhood |= np.roll(prev_grid, 1, axis=1)
+            results[:, epoch] = self.RULE_TABLES[rule_rows, neighborhood]
+
+        return results
+
+    # Evolve the grid n-times with the engine selected in the constructor
+    def _evolve_rule(self, rule_number):
+        if self._detect_cycles:
+            rule_table = self._generate_rule_table(rule_number)
+            results, self._cycles[rule_number] = self._evolve_grid_n_times_numpy_cycles(
+                self._number_of_epochs, self._intial_grid, rule_table)
+            return results
+        if self._engine == "memory":
+            rule_table = self._generate_rule_table(rule_number)
+            return self._evolve_grid_n_times_memory(self._number_of_epochs, self._intial_grid, rule_table)
+        if self._engine in ("numpy", "batched"):
+            rule_table = self._generate_rule_table(rule_number)
+            return self._evolve_grid_n_times_numpy(self._number_of_epochs, self._intial_grid, rule_table)
         value_grid = self._generate_value_grid(rule_number)
-        plt.title(f"Evolution of Memory-Based Cellular Automaton based on rule number: {rule_number} \n {value_grid}")
-        plt.show()
+        return self._evolve_grid_n_times_meca(self._number_of_epochs, self._intial_grid, value_grid)
 
-    # Simulate all of the defined rules  
-    def _simulate_all_rules(self):
-        for rule_number in range(256):
+    # Visualize the evolution of the grid, matplotlib is only imported here.
+    # Diagrams larger than max_shape are block reduced to live cell densities
+    def _plot_binary_map(self, results, rule_number, max_shape=(1000, 1500)):
+        import matplotlib.pyplot as plt
+
+        with self._phase("plotting"):
+            results = np.asarray(results)
+            image = block_reduce(results, max_shape)
+            plt.figure(figsize=(15, 10))
+            plt.imshow(image, cmap='binary', interpolation='nearest', aspect='auto', vmin=0, vmax=1,
+                       extent=(-0.5, results.shape[1] - 0.5, results.shape[0] - 0.5, -0.5))
+            plt.colorbar(label="State (0 or 1)" if image is results else "Live cell density")
+            plt.xlabel("Cell Index")
+            plt.ylabel("Epoch")
             value_grid = self._generate_value_grid(rule_number)
-            results = self._evolve_grid_n_times_meca(self._number_of_epochs, self._intial_grid, value_grid)
+            plt.title(f"Evolution of Memory-Based Cellular Automaton based on rule number: {rule_number} \n {value_grid}")
+            plt.show()
+
+    # Keeps the solved grids of the rule, in the store when one is used
+    def _save_results(self, rule_number, results):
+        if self._store is not None:
+            self._store.write_rule(rule_number, results)
+        else:
             self._all_results[rule_number] = results
-            if rule_number % 10 == 0 and rule_number > 0:
-                print(f"I have solved grids for rules num {rule_number-10} - {rule_number}")
-            elif rule_number == 255:
-                print("I have finished solving the whole space of grids")
 
+    # Loads the solved grids of the rule, reading only that rule from the store
+    def _load_results(self, rule_number):
+        if self._store is not None:
+            return self._store.read_rule(rule_number) if rule_number in self._store else None
+        return self._all_results.get(rule_number)
+
+    # Times a phase when instrumentation is attached
+    def _phase(self, name):
+        return self.instrumentation.phase(name) if self.instrumentation is not None else nullcontext()
+
+    # Simulate all of the defined rules, progress is reported to the attached
+    # instrumentation. It is looked up once, a detached run calls no hook
+    def _simulate_all_rules(self):
+        instrumentation = self.instrumentation
+        # With cycle detection rules are solved one by one so they can stop early
+        if self._engine == "batched" and not self._detect_cycles:
+            with self._phase("stepping"):
+                results = self._evolve_all_rules_n_times_batched(self._number_of_epochs, self._intial_grid)
+            # Every rule keeps a view into the single (256, epochs + 1, N) block
+            for rule_number in range(256):
+                with self._phase("storage"):
+                    self._save_results(rule_number, results[rule_number])
+                if instrumentation is not None:
+                    instrumentation.count(self._number_of_epochs)
+                    instrumentation.observe(rule_number, results[rule_number])
+            return
+
+        for rule_number in range(256):
+            with self._phase("stepping"):
+                results = self._evolve_rule(rule_number)
+            with self._phase("storage"):
+                self._save_results(rule_number, results)
+            if instrumentation is not None:
+                instrumentation.count(len(results) - 1)
+                instrumentation.observe(rule_number, results)
+
+    # Classifies the solved rules by the cycles they reached
+    def _classify_rules(self):
+        return {rule_number: classify_cycle(cycle) for rule_number, cycle in self._cycles.items()}
 
     # Visualises the selected rule based on precomputed results
     def view_rule_number(self, rule_number):
-        results = self._all_results[rule_number]
-        if not results:
+        results = self._load_results(rule_number)
+        if results is None or len(results) == 0:
             print("Grids must be solved prior to visualisation")
+            return
         self._plot_binary_map(results, rule_number)
 
     # Visualises all rules based on precomputed term (use with caution due to memory requirements)
     def iterate_and_view_all_rules(self):
         for rule_num in range(256):
-            self.view_rule_number(rule_num)
\ No newline at end of file
+            self.view_rule_number(rule_num)
+
+    # Writes the solved rules as one tiled PNG atlas, tiles are rendered in a
+    # process pool reading from the store when one is used
+    def save_rule_atlas(self, path, tile_shape=(128, 128), columns=16, workers=None):
+        sources = self._store._path if self._store is not None else self._all_results
+        with self._phase("plotting"):
+            return write_rule_atlas(path, sources, range(256), tile_shape, columns, workers)
\ No newline at end of file
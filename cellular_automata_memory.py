@@ -0,0 +1,83 @@
+import numpy as np
+
+
+# Class that keeps the last depth generations of a memory based automaton in a
+# preallocated ring buffer together with a running aggregate of them, so both
+# pushing a generation and reading the remembered (trait) state cost O(N)
+# whatever the memory depth is.
+#   "xor"      trait is the XOR of the remembered generations
+#   "majority" trait is the state held by most of the remembered generations
+#   "weighted" generation t - j has weight memory_factor ** j, the trait is the
+#              state with the larger total weight
+# Ties keep the latest generation
+class Memory_Ring_Buffer:
+    COMBINES = ("xor", "majority", "weighted")
+
+    def __init__(self, depth, length, combine="majority", memory_factor=1.0):
+        if depth < 1:
+            raise ValueError("Memory depth must be at least 1")
+        if combine not in self.COMBINES:
+            raise ValueError(f"Unknown memory combine {combine}, expected one of {self.COMBINES}")
+
+        self._depth = depth
+        self._combine = combine
+        self._memory_factor = memory_factor
+        self._history = np.zeros((depth, length), dtype=np.uint8)
+        self._head = 0
+        self._filled = 0
+        self._latest = None
+
+        if combine == "xor":
+            self._aggregate = np.zeros(length, dtype=np.uint8)
+        elif combine == "majority":
+            self._aggregate = np.zeros(length, dtype=np.int64)
+        else:
+            self._aggregate = np.zeros(length, dtype=np.float64)
+            self._total_weight = 0.0
+
+    # Stores a new generation, the oldest one leaves the buffer once it is full
+    def push(self, grid):
+        full = self._filled == self._depth
+        oldest = self._history[self._head]
+
+        if self._combine == "xor":
+            if full:
+                self._aggregate ^= oldest
+            self._aggregate ^= grid
+        elif self._combine == "majority":
+            if full:
+                self._aggregate -= oldest
+            self._aggregate += grid
+        else:
+            self._aggregate *= self._memory_factor
+            self._total_weight *= self._memory_factor
+            if full:
+                self._aggregate -= self._memory_factor ** self._depth * oldest
+                self._total_weight -= self._memory_factor ** self._depth
+            self._aggregate += grid
+            self._total_weight += 1.0
+
+        self._history[self._head] = grid
+        self._latest = self._history[self._head]
+        self._head = (self._head + 1) % self._depth
+        self._filled = min(self._filled + 1, self._depth)
+
+    # Writes the trait state combined from the remembered generations into out
+    def trait(self, out):
+        if self._combine == "xor":
+            np.copyto(out, self._aggregate)
+            return out
+
+        if self._combine == "majority":
+            doubled = 2 * self._aggregate
+            half = self._filled
+        else:
+            doubled = 2 * self._aggregate
+            half = self._total_weight
+            # Equal weights are ties even after floating point rounding
+            doubled[np.isclose(doubled, half)] = half
+
+        np.copyto(out, self._latest)
+        out[doubled > half] = 1
+        out[doubled < half] = 0
+        return out
@@ -0,0 +1,60 @@
+import numpy as np
+
+
+# Observables that reduce one generation of a 1D automaton to a single number.
+# Every observer is called as observer(grid, prev_grid), prev_grid is None for
+# the initial generation
+
+
+# Fraction of cells out of the quiescent state 0
+def density(grid, prev_grid):
+    return np.count_nonzero(grid) / grid.size
+
+
+# Number of cells that changed since the previous generation
+def hamming_distance(grid, prev_grid):
+    if prev_grid is None:
+        return 0
+    return int(np.count_nonzero(grid != prev_grid))
+
+
+# Shannon entropy (bits) of the distribution of length block_size words read
+# along the rows of the periodic grid of a k-state automaton
+class Block_Entropy:
+    def __init__(self, block_size=3, states=2):
+        self._block_size = block_size
+        self._states = states
+
+    def __call__(self, grid, prev_grid):
+        words = np.zeros(grid.shape, dtype=np.int64)
+        for shift in range(self._block_size):
+            words *= self._states
+            words += np.roll(grid, -shift, axis=-1)
+        counts = np.bincount(words.ravel(), minlength=self._states ** self._block_size)
+        probabilities = counts[counts > 0] / grid.size
+        return float(-(probabilities * np.log2(probabilities)).sum())
+
+
+# Default set of observers used when none are registered
+DEFAULT_OBSERVERS = {
+    "density": density,
+    "block_entropy": Block_Entropy(3),
+    "hamming_distance": hamming_distance,
+}
+
+
+# Reduces a stream of generations through the observers, only the previous
+# generation is kept, so memory stays O(N) regardless of the number of epochs
+def observe_generations(generations, observers=None):
+    observers = DEFAULT_OBSERVERS if observers is None else observers
+    series = {name: [] for name in observers}
+    prev_grid = None
+
+    for grid in generations:
+        for name, observer in observers.items():
+            series[name].append(observer(grid, prev_grid))
+        if prev_grid is None:
+            prev_grid = np.empty_like(grid)
+        np.copyto(prev_grid, grid)
+
+    return {name: np.asarray(values, dtype=np.float64) for name, values in series.items()}
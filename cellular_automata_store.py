@@ -0,0 +1,113 @@
+import os
+
+import numpy as np
+
+
+# Class that keeps bit-packed spacetime diagrams of all 256 rules in one
+# memory-mapped file. The file starts with a fixed header holding a per-rule
+# index of (offset, number of generations, number of cells), packed diagrams
+# (1 bit per cell) are appended after it and read back only on demand. A
+# read-only store never creates or writes its file
+class Spacetime_Store:
+    MAGIC = b"MECASTR1"
+    NUMBER_OF_RULES = 256
+    INDEX_DTYPE = np.dtype("<i8")
+    HEADER_SIZE = len(MAGIC) + NUMBER_OF_RULES * 3 * INDEX_DTYPE.itemsize
+
+    def __init__(self, path, read_only=False):
+        self._path = path
+        self._read_only = read_only
+        self._data = None
+
+        if not os.path.exists(path):
+            if read_only:
+                raise FileNotFoundError(f"Spacetime store {path} does not exist")
+            self._index = np.full((self.NUMBER_OF_RULES, 3), -1, dtype=self.INDEX_DTYPE)
+            with open(path, "wb") as file:
+                file.write(self.MAGIC)
+                file.write(self._index.tobytes())
+        else:
+            with open(path, "rb") as file:
+                if file.read(len(self.MAGIC)) != self.MAGIC:
+                    raise ValueError(f"{path} is not a spacetime store")
+                index = file.read(self.HEADER_SIZE - len(self.MAGIC))
+            self._index = np.frombuffer(index, dtype=self.INDEX_DTYPE).reshape(self.NUMBER_OF_RULES, 3).copy()
+
+    def __contains__(self, rule_number):
+        return self._index[rule_number, 0] >= 0
+
+    # Rule numbers that have a stored diagram
+    def rules(self):
+        return np.flatnonzero(self._index[:, 0] >= 0).tolist()
+
+    # Bytes of the packed diagram of the rule
+    def _entry_size(self, rule_number):
+        _, number_of_rows, number_of_cells = self._index[rule_number]
+        return int(number_of_rows) * ((int(number_of_cells) + 7) // 8)
+
+    def _check_writable(self):
+        if self._read_only:
+            raise ValueError(f"Spacetime store {self._path} is opened read-only")
+
+    # Packs the (epochs + 1, N) diagram of the rule and writes it to the file.
+    # A rewritten rule whose packed diagram fits its old entry overwrites it in
+    # place, otherwise it is appended and the store is compacted once the
+    # unused bytes outweigh the used ones
+    def write_rule(self, rule_number, results):
+        self._check_writable()
+        results = np.asarray(results, dtype=np.uint8)
+        packed = np.packbits(results, axis=1)
+
+        with open(self._path, "r+b") as file:
+            if rule_number in self and packed.nbytes <= self._entry_size(rule_number):
+                offset = int(self._index[rule_number, 0])
+                file.seek(offset)
+            else:
+                file.seek(0, os.SEEK_END)
+                offset = file.tell()
+            file.write(packed.tobytes())
+
+            self._index[rule_number] = (offset, results.shape[0], results.shape[1])
+            file.seek(len(self.MAGIC) + rule_number * 3 * self.INDEX_DTYPE.itemsize)
+            file.write(self._index[rule_number].tobytes())
+            file_size = file.seek(0, os.SEEK_END)
+
+        # The file may have changed size, the map is reopened on the next read
+        self._data = None
+
+        used = sum(self._entry_size(rule) for rule in self.rules())
+        if file_size - self.HEADER_SIZE - used > used:
+            self.compact()
+
+    # Rewrites the file with only the stored diagrams, back to back in rule
+    # order, and replaces the old file once the new one is complete
+    def compact(self):
+        self._check_writable()
+        index = np.full((self.NUMBER_OF_RULES, 3), -1, dtype=self.INDEX_DTYPE)
+        temporary_path = f"{self._path}.compact"
+        with open(self._path, "rb") as source, open(temporary_path, "wb") as target:
+            target.write(self.MAGIC)
+            target.write(index.tobytes())
+            for rule_number in self.rules():
+                source.seek(int(self._index[rule_number, 0]))
+                index[rule_number] = (target.tell(), *self._index[rule_number, 1:])
+                target.write(source.read(self._entry_size(rule_number)))
+            target.seek(len(self.MAGIC))
+            target.write(index.tobytes())
+
+        self._data = None
+        os.replace(temporary_path, self._path)
+        self._index = index
+
+    # Reads and unpacks the diagram of a single rule from the memory map
+    def read_rule(self, rule_number):
+        if rule_number not in self:
+            raise KeyError(f"Rule {rule_number} is not in the store")
+
+        if self._data is None:
+            self._data = np.memmap(self._path, dtype=np.uint8, mode="r")
+
+        offset, number_of_rows, number_of_cells = self._index[rule_number]
+        row_bytes = (int(number_of_cells) + 7) // 8
+        packed = self._data[offset:offset + self._entry_size(rule_number)].reshape(number_of_rows, row_bytes)
+        return np.unpackbits(packed, axis=1, count=int(number_of_cells))
@@ -0,0 +1,92 @@
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+# Opt-in instrumentation shared by the models. A model runs without it until an
+# Instrumentation is attached to its instrumentation attribute,
+#   model.instrumentation = Instrumentation(observer=callback, observe_every=100)
+# The models only use it through this duck-typed surface:
+#   phase(name)          context manager timing "setup", "stepping", "storage" or "plotting"
+#   count(steps)         adds performed model steps
+#   observer             None or the callback, models skip state sampling when None
+#   observe(step, state) passes every observe_every-th step to the callback
+# so modules that cannot import this one (term_project) can be instrumented too.
+# States are observed from the stepping loops as they are computed, per epoch
+# by Cellular_Automaton and Cellular_Automaton_2D, per iteration by the fixed
+# step ET_model and by ET_stochastic, and per block (fixed step) or per segment
+# between clamping events (adaptive) by AlzheimerModel. Adaptive ET runs pass
+# each segment between doses when the solver returns and Meca_Cellular_Automata
+# observes per rule, the step is the rule number and the state its grids.
+class Instrumentation:
+    PHASES = ("setup", "stepping", "storage", "plotting")
+
+    # observer: callback(step, state), state is the model's live state (reused
+    #   buffers, copy to keep it)
+    # track_allocations: record the tracemalloc peak of every phase, tracing
+    #   slows the run down considerably
+    def __init__(self, observer=None, observe_every=1, track_allocations=False):
+        self.observer = observer
+        self._observe_every = observe_every
+        self._track_allocations = track_allocations
+        self._tracing_depth = 0
+        self.reset()
+
+    # Clears all measurements
+    def reset(self):
+        self.seconds = {}
+        self.calls = {}
+        self.peak_memory = {}
+        self.steps = 0
+
+    # Times the phase and tracks its allocation peak, repeated phases accumulate
+    @contextmanager
+    def phase(self, name):
+        if self._track_allocations:
+            self._start_tracing()
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.seconds[name] = self.seconds.get(name, 0.0) + time.perf_counter() - start
+            self.calls[name] = self.calls.get(name, 0) + 1
+            if self._track_allocations:
+                _, peak = tracemalloc.get_traced_memory()
+                self.peak_memory[name] = max(self.peak_memory.get(name, 0), peak)
+                self._stop_tracing()
+
+    def _start_tracing(self):
+        # Tracing is started by the outermost phase unless it is already on,
+        # the peak is reset so every phase reports its own
+        if self._tracing_depth == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._tracing_depth = 1
+        elif self._tracing_depth:
+            self._tracing_depth += 1
+        tracemalloc.reset_peak()
+
+    def _stop_tracing(self):
+        if self._tracing_depth:
+            self._tracing_depth -= 1
+            if self._tracing_depth == 0:
+                tracemalloc.stop()
+
+    # Adds performed model steps
+    def count(self, steps):
+        self.steps += steps
+
+    # Passes the state of every observe_every-th step to the observer
+    def observe(self, step, state):
+        if self.observer is not None and step % self._observe_every == 0:
+            self.observer(step, state)
+
+    # Measurements as a dict, steps per second are over the stepping phase
+    def report(self):
+        stepping = self.seconds.get("stepping", 0.0)
+        return {
+            "seconds": dict(self.seconds),
+            "calls": dict(self.calls),
+            "peak_memory_bytes": dict(self.peak_memory),
+            "steps": self.steps,
+            "steps_per_second": self.steps / stepping if stepping else None,
+        }
@@ -0,0 +1,140 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from cellular_automata_store import Spacetime_Store
+
+
+# Rendering helpers that reduce large results to screen resolution before they
+# reach a plotting library: min/max preserving LTTB downsampling of time series,
+# block reduction of spacetime diagrams and a tiled PNG atlas of many rules.
+
+
+# Indices of the minimum and maximum of every bucket, so no spike is lost
+def _minmax_indices(y, buckets):
+    edges = np.linspace(0, len(y), buckets + 1).astype(np.int64)
+    starts, stops = edges[:-1], edges[1:]
+    width = int((stops - starts).max())
+    # Buckets are read as rows of a padded (buckets, width) view
+    positions = np.minimum(starts[:, None] + np.arange(width), stops[:, None] - 1)
+    values = y[positions]
+    rows = np.arange(buckets)
+    indices = np.concatenate([positions[rows, values.argmin(axis=1)], positions[rows, values.argmax(axis=1)]])
+    return np.unique(indices)
+
+
+# Largest triangle three buckets, keeps the first and last point and from every
+# bucket in between the point forming the largest triangle with the previously
+# kept point and the mean of the next bucket
+def _lttb_indices(x, y, max_points):
+    edges = np.linspace(1, len(x) - 1, max_points - 1).astype(np.int64)
+    selected = np.empty(max_points, dtype=np.int64)
+    selected[0], selected[-1] = 0, len(x) - 1
+
+    for bucket in range(max_points - 2):
+        start, stop = edges[bucket], edges[bucket + 1]
+        next_stop = edges[bucket + 2] if bucket + 2 < len(edges) else len(x)
+        mean_x, mean_y = x[stop:next_stop].mean(), y[stop:next_stop].mean()
+        previous = selected[bucket]
+        area = np.abs((x[previous] - mean_x) * (y[start:stop] - y[previous])
+                      - (x[previous] - x[start:stop]) * (mean_y - y[previous]))
+        selected[bucket + 1] = start + int(area.argmax())
+
+    return selected
+
+
+# Downsamples a time series to at most max_points points. The minimum and
+# maximum of minmax_ratio * max_points / 2 buckets are preselected and LTTB
+# picks the final points from them (MinMaxLTTB), so the shape and the extremes
+# survive at a cost linear in the length of the series
+def downsample(x, y, max_points, minmax_ratio=4):
+    x, y = np.asarray(x), np.asarray(y)
+    if max_points is None or len(y) <= max_points:
+        return x, y
+    if max_points < 3:
+        raise ValueError("Downsampling needs at least 3 points")
+
+    candidates = np.arange(len(y))
+    buckets = max_points * minmax_ratio // 2
+    if len(y) > 2 * buckets:
+        candidates = _minmax_indices(y, buckets)
+        candidates = np.union1d(candidates, [0, len(y) - 1])
+    selected = candidates[_lttb_indices(x[candidates].astype(float), y[candidates].astype(float), max_points)]
+    return x[selected], y[selected]
+
+
+# Reduces a 2D array to at most max_shape by averaging blocks, a binary
+# spacetime diagram becomes the density of live cells of every block
+def block_reduce(grid, max_shape):
+    grid = np.asarray(grid)
+    reduced = grid
+    for axis, limit in enumerate(max_shape):
+        length = grid.shape[axis]
+        if length <= limit:
+            continue
+        edges = np.linspace(0, length, limit + 1).astype(np.int64)[:-1]
+        sums = np.add.reduceat(reduced, edges, axis=axis, dtype=np.float64)
+        counts = np.diff(np.append(edges, length))
+        reduced = sums / np.expand_dims(counts, 1 - axis)
+    return reduced
+
+
+# Renders one rule into a uint8 tile, 255 for dead and 0 for live cells, the
+# grids are read by the worker from the read-only store or passed with the
+# job. Rules without grids get a blank tile
+def _render_tile(job):
+    rule_number, source, tile_shape = job
+    if isinstance(source, str):
+        store = Spacetime_Store(source, read_only=True)
+        results = store.read_rule(rule_number) if rule_number in store else None
+    else:
+        results = source
+    if results is None or len(results) == 0:
+        return rule_number, np.full(tile_shape, 255, dtype=np.uint8)
+
+    density = block_reduce(np.asarray(results), tile_shape)
+    # Nearest neighbor upscaling of small diagrams, every tile has tile_shape
+    rows = np.arange(tile_shape[0]) * density.shape[0] // tile_shape[0]
+    columns = np.arange(tile_shape[1]) * density.shape[1] // tile_shape[1]
+    tile = 255 - np.rint(255 * density[rows[:, None], columns]).astype(np.uint8)
+    return rule_number, tile
+
+
+# Writes the spacetime diagrams of the rules as one tiled PNG, rule after rule
+# row-major with columns tiles per row and a 1 pixel gap. sources maps rule
+# numbers to grids or is the path of a Spacetime_Store, rules missing from it
+# are left blank. Tiles are rendered in a process pool and the PNG is written
+# once
+def write_rule_atlas(path, sources, rules=range(256), tile_shape=(128, 128), columns=16, workers=None):
+    rules = list(rules)
+    if isinstance(sources, str):
+        # Fails early on a missing store instead of in every worker
+        Spacetime_Store(sources, read_only=True)
+        jobs = [(rule_number, sources, tile_shape) for rule_number in rules]
+    else:
+        jobs = [(rule_number, sources.get(rule_number), tile_shape) for rule_number in rules]
+
+    rows = -(-len(rules) // columns)
+    height, width = tile_shape
+    atlas = np.full((rows * (height + 1) - 1, columns * (width + 1) - 1), 128, dtype=np.uint8)
+    positions = {rule_number: divmod(index, columns) for index, rule_number in enumerate(rules)}
+
+    workers = workers or os.cpu_count()
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        if executor is None:
+            tiles = map(_render_tile, jobs)
+        else:
+            tiles = executor.map(_render_tile, jobs, chunksize=max(1, len(jobs) // (4 * workers)))
+        for rule_number, tile in tiles:
+            row, column = positions[rule_number]
+            atlas[row * (height + 1):row * (height + 1) + height, column * (width + 1):column * (width + 1) + width] = tile
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    import matplotlib.pyplot as plt
+
+    plt.imsave(path, atlas, cmap="gray", vmin=0, vmax=255)
+    return atlas
@@ -0,0 +1,121 @@
+import hashlib
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+
+# Feeds a value into the hash, arrays by dtype, shape and raw bytes and
+# everything else (numbers, strings, lists and tuples of them) by repr
+def _update_hash(digest, value):
+    if isinstance(value, np.ndarray) or isinstance(value, np.generic):
+        array = np.ascontiguousarray(value)
+        digest.update(f"array:{array.dtype.str}:{array.shape}:".encode())
+        digest.update(array.tobytes())
+    elif isinstance(value, (list, tuple)):
+        digest.update(f"{type(value).__name__}:{len(value)}:".encode())
+        for item in value:
+            _update_hash(digest, item)
+    elif isinstance(value, dict):
+        digest.update(f"dict:{len(value)}:".encode())
+        for key in sorted(value):
+            _update_hash(digest, key)
+            _update_hash(digest, value[key])
+    else:
+        digest.update(f"{type(value).__name__}:{value!r};".encode())
+
+
+# Class that memoizes model runs by a hash of everything that determines the
+# result: model class, method, parameters, initial state, time grid,
+# integrator and call arguments. Models take part by implementing
+#   _cache_key_parts()       values identifying the configuration
+#   _cache_arrays()          result arrays to store after a run
+#   _cache_restore(arrays)   puts stored arrays back and returns the result
+# Results live in an in-memory LRU tier and optionally in a directory of npz
+# files whose total size is kept under max_disk_bytes by evicting the least
+# recently used files
+class Result_Cache:
+    def __init__(self, max_entries=32, directory=None, max_disk_bytes=1 << 30):
+        self._max_entries = max_entries
+        self._directory = directory
+        self._max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def key(self, model, method, *args, **kwargs):
+        digest = hashlib.sha256()
+        _update_hash(digest, [type(model).__name__, method, model._cache_key_parts(), list(args), kwargs])
+        return digest.hexdigest()
+
+    # Runs model.method(*args, **kwargs) or restores its stored result
+    def call(self, model, method, *args, **kwargs):
+        key = self.key(model, method, *args, **kwargs)
+        arrays = self._get(key)
+        if arrays is not None:
+            self.hits += 1
+            return model._cache_restore(arrays)
+
+        self.misses += 1
+        result = getattr(model, method)(*args, **kwargs)
+        self._put(key, model._cache_arrays())
+        return result
+
+    def _get(self, key):
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return self._memory[key]
+
+        path = self._path(key)
+        if path is None or not os.path.exists(path):
+            return None
+        with np.load(path) as stored:
+            arrays = {name: stored[name] for name in stored.files}
+        for value in arrays.values():
+            value.setflags(write=False)
+        os.utime(path)
+        self._remember(key, arrays)
+        return arrays
+
+    def _put(self, key, arrays):
+        # Stored arrays are shared by every hit, they are made read-only
+        arrays = {name: np.array(value) for name, value in arrays.items()}
+        for value in arrays.values():
+            value.setflags(write=False)
+        self._remember(key, arrays)
+
+        path = self._path(key)
+        if path is not None:
+            temporary = path + ".tmp.npz"
+            np.savez(temporary, **arrays)
+            os.replace(temporary, path)
+            self._evict_disk()
+
+    def _remember(self, key, arrays):
+        self._memory[key] = arrays
+        self._memory.move_to_end(key)
+        while len(self._memory) > self._max_entries:
+            self._memory.popitem(last=False)
+
+    def _path(self, key):
+        return None if self._directory is None else os.path.join(self._directory, f"{key}.npz")
+
+    def _evict_disk(self):
+        files = [os.path.join(self._directory, name) for name in os.listdir(self._directory) if name.endswith(".npz")]
+        files = [(os.stat(path), path) for path in files]
+        total = sum(stat.st_size for stat, _ in files)
+        for stat, path in sorted(files, key=lambda item: item[0].st_mtime):
+            if total <= self._max_disk_bytes:
+                break
+            os.remove(path)
+            total -= stat.st_size
+
+    def clear(self):
+        self._memory.clear()
+        if self._directory is not None:
+            for name in os.listdir(self._directory):
+                if name.endswith(".npz"):
+                    os.remove(os.path.join(self._directory, name))
@@ -0,0 +1,189 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import yaml
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(ROOT, "term_project"))
+
+# Headless command line entry point, runs models from YAML configs and writes
+# their results to compressed npz or Parquet files. A config is one run or a
+# list of runs under "runs:", keys outside of "runs" are defaults of every run,
+#
+#   model: et                       et, et_ensemble, et_stochastic, alzheimer,
+#                                   meca, automaton, automaton_2d or compartments
+#   parameters: {E: 300, T: 500, ...}    constructor arguments of the model
+#   run: {iterations: 1000}              arguments of the run itself
+#   output: results/et.npz               .npz or .parquet
+#   plot: false                          show the model's plots after the run
+#
+# Arrays are written time (iteration, epoch) major. Models are imported when
+# a run needs them and plotting libraries only when a plot is requested, so
+# a batch of runs in one process pays for every import once.
+#
+#   python run_models.py run_models.yaml
+
+
+def _run_et(model_class, parameters, run, plot):
+    model = model_class(**parameters)
+    T, E = model.observe(run["iterations"], run.get("modulation", []))
+    arrays = {"T": np.moveaxis(T, -1, 0), "E": np.moveaxis(E, -1, 0)}
+    if hasattr(model, "extinction_times"):
+        arrays["extinction_time"] = model._extinction_time
+    if plot:
+        model.plot_scatter()
+    return arrays
+
+
+def _run_alzheimer(parameters, run, plot, directory):
+    from alzheimer_model import SPECIES, AlzheimerModel
+
+    parameters = dict(parameters)
+    for path in ("path_params", "path_initial_state"):
+        parameters[path] = os.path.join(directory, parameters[path])
+    model = AlzheimerModel(**parameters)
+    model.simulate()
+    arrays = {"time": model.start_time + model.time_step * np.arange(len(model.history))}
+    arrays.update({species: model.trajectory(species) for species in SPECIES})
+    if plot:
+        model.plot_scatter()
+    return arrays
+
+
+def _run_meca(parameters, run, plot):
+    from cellular_automata_meca import Meca_Cellular_Automata
+
+    parameters = dict(parameters)
+    seed = parameters.pop("seed", None)
+    automaton = Meca_Cellular_Automata(rng=np.random.default_rng(seed), **parameters)
+    rules = run.get("rules", "all")
+    if rules == "all":
+        automaton._simulate_all_rules()
+        rules = range(256)
+    else:
+        for rule_number in rules:
+            automaton._save_results(rule_number, automaton._evolve_rule(rule_number))
+
+    arrays = {f"rule_{rule_number}": np.asarray(automaton._load_results(rule_number)) for rule_number in rules}
+    if plot:
+        for rule_number in rules:
+            automaton.view_rule_number(rule_number)
+    return arrays
+
+
+def _run_automaton(model_class, parameters, run, plot):
+    parameters = dict(parameters)
+    seed = parameters.pop("seed", None)
+    automaton = model_class(**parameters)
+    rng = np.random.default_rng(seed)
+    size = run["size"]
+    grid = (rng.integers(0, automaton._states, size=size, dtype=automaton._dtype)
+            if isinstance(size, list) else automaton.random_grid(size, rng))
+    results = automaton.evolve(run["epochs"], grid)
+    if plot:
+        automaton.plot(results)
+    return {"generations" if results.ndim == 2 and grid.ndim == 1 else "lattice": results}
+
+
+def _run_compartments(parameters, run, plot):
+    from basic_model_of_immunity import Linear_Compartment_Model
+
+    if "coefficients" in parameters:
+        model = Linear_Compartment_Model.from_chain(parameters["coefficients"], parameters.get("feedback", -1))
+        initial_state = model.chain_state(run["n0"]) if "n0" in run else run["initial_state"]
+    else:
+        model = Linear_Compartment_Model(parameters["transfer"], parameters.get("labels"))
+        initial_state = run["initial_state"]
+    results = model.observe(run["steps"], initial_state)
+    if plot:
+        model.plot_scatter()
+    return {"states": np.moveaxis(results, -2, 0)}
+
+
+def run_model(config, directory="."):
+    # Runs one config entry and returns its results as {name: array}
+    model = config["model"]
+    parameters = config.get("parameters", {})
+    run = config.get("run", {})
+    plot = config.get("plot", False)
+
+    if model in ("et", "et_ensemble", "et_stochastic"):
+        if model == "et_stochastic":
+            from ET_stochastic import ET_stochastic as model_class
+        else:
+            from ET_model import ET_model, ET_ensemble
+            model_class = ET_model if model == "et" else ET_ensemble
+        return _run_et(model_class, parameters, run, plot)
+    if model == "alzheimer":
+        return _run_alzheimer(parameters, run, plot, directory)
+    if model == "meca":
+        return _run_meca(parameters, run, plot)
+    if model == "automaton":
+        from cellular_automata import Cellular_Automaton
+        return _run_automaton(Cellular_Automaton, parameters, run, plot)
+    if model == "automaton_2d":
+        from cellular_automata_2d import Cellular_Automaton_2D
+        return _run_automaton(Cellular_Automaton_2D, parameters, run, plot)
+    if model == "compartments":
+        return _run_compartments(parameters, run, plot)
+    raise ValueError(f"Unknown model {model}")
+
+
+def write_results(path, arrays):
+    # Writes the arrays to a compressed npz or to a Parquet table, the table
+    # has a row per time step and 2D arrays are split into name_j columns
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    if path.endswith(".npz"):
+        np.savez_compressed(path, **arrays)
+    elif path.endswith(".parquet"):
+        import pandas as pd
+
+        lengths = {len(array) for array in arrays.values()}
+        if len(lengths) != 1:
+            raise ValueError(f"Parquet output needs arrays of one length, got {sorted(lengths)}, use npz")
+        columns = {}
+        for name, array in arrays.items():
+            array = np.asarray(array).reshape(len(array), -1)
+            if array.shape[1] == 1:
+                columns[name] = array[:, 0]
+            else:
+                columns.update({f"{name}_{column}": array[:, column] for column in range(array.shape[1])})
+        pd.DataFrame(columns).to_parquet(path, compression="zstd")
+    else:
+        raise ValueError(f"Unknown output format of {path}, expected .npz or .parquet")
+
+
+def load_runs(path):
+    # Run entries of a config file, defaults merged into every run
+    with open(path) as file:
+        config = yaml.safe_load(file)
+    defaults = {key: value for key, value in config.items() if key != "runs"}
+    return [{**defaults, **run} for run in config.get("runs", [{}])]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run models from YAML configs")
+    parser.add_argument("configs", nargs="+", help="YAML config files")
+    parser.add_argument("--output-dir", default=None, help="directory for outputs given by relative paths")
+    parser.add_argument("--plot", action="store_true", help="show the plots of every run")
+    args = parser.parse_args(argv)
+
+    for config_path in args.configs:
+        directory = os.path.dirname(os.path.abspath(config_path))
+        for index, config in enumerate(load_runs(config_path)):
+            if args.plot:
+                config["plot"] = True
+            start = time.perf_counter()
+            arrays = run_model(config, directory)
+            output = config.get("output", f"{os.path.splitext(os.path.basename(config_path))[0]}_{index}.npz")
+            output = os.path.join(args.output_dir or directory, output)
+            write_results(output, arrays)
+            print(f"{config['model']} -> {output} ({time.perf_counter() - start:.2f} s)", flush=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
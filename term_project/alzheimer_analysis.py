@@ -0,0 +1,122 @@
+import numpy as np
+
+from alzheimer_model import SPECIES
+
+
+class AlzheimerAnalysis:
+    """
+    Analysis of the linear dynamics d(state)/dt = A @ state of an AlzheimerModel.
+    Between clamping events the trajectory is exp(A t) @ state, so states at arbitrary
+    times, the equilibrium and the timescales of the system follow from A directly.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.matrix = model.system_matrix()
+        self._propagators = {}
+
+    def propagator(self, duration: float):
+        """
+        Return the exact propagator exp(A * duration), cached per duration.
+        """
+        if duration not in self._propagators:
+            from scipy.linalg import expm
+
+            self._propagators[duration] = expm(self.matrix * duration)
+        return self._propagators[duration]
+
+    def propagate(self, times, state=None, check_points: int = 8):
+        """
+        Return the states at the given times (measured from 'state', by default the model's
+        current state) as a (len(times), 7) array. Each interval is a single jump with the
+        cached propagator. The jump is verified at 'check_points' evenly spaced points, and if a
+        species would cross zero there the interval falls back to clamped stepping with the
+        exact propagator of the model's time step.
+        """
+        times = np.asarray(times, dtype=float)
+        if np.any(np.diff(times) < 0) or (len(times) and times[0] < 0):
+            raise ValueError("Times must be non-negative and sorted")
+
+        state = self.model.get_state() if state is None else np.array(state, dtype=float)
+        results = np.empty((len(times), 7))
+        time = 0.0
+
+        for index, target in enumerate(times):
+            duration = target - time
+            if duration > 0:
+                checkpoint = self.propagator(duration / check_points)
+                candidate = state
+                crossed = False
+                for _ in range(check_points):
+                    candidate = checkpoint @ candidate
+                    crossed |= bool(np.any(candidate < 0))
+                state = self._step_clamped(state, duration) if crossed else candidate
+            results[index] = state
+            time = target
+
+        return results
+
+    def _step_clamped(self, state, duration: float):
+        """
+        Advance the state over 'duration' with clamped steps of at most the model's time step.
+        """
+        steps = max(1, int(np.ceil(duration / self.model.time_step)))
+        trajectory = np.empty((steps + 1, 7))
+        trajectory[0] = state
+        self.model._step_blocks(self.propagator(duration / steps), trajectory)
+        return trajectory[-1]
+
+    def equilibrium(self, state=None, tolerance: float = 1e-10):
+        """
+        Solve for the equilibrium reached from 'state' (by default the model's current state).
+        Equilibria are the null space of A; the conserved quantities (left null vectors of A)
+        select the one reached from the given state. It is only approached if all other
+        eigenvalues have negative real parts ('stable'), and it is only valid for the clamped
+        model if no species is negative ('feasible').
+        """
+        from scipy.linalg import null_space
+
+        state = self.model.get_state() if state is None else np.array(state, dtype=float)
+        scale = max(np.abs(self.matrix).max(), 1.0)
+        right = null_space(self.matrix, rcond=tolerance * scale)
+        left = null_space(self.matrix.T, rcond=tolerance * scale)
+
+        if right.shape[1] == 0:
+            equilibrium = np.zeros(7)
+        else:
+            # Spectral projection of the state onto the null space along the other eigenvectors
+            equilibrium = right @ np.linalg.solve(left.T @ right, left.T @ state)
+
+        eigenvalues = np.linalg.eigvals(self.matrix)
+        nonzero = np.abs(eigenvalues) > tolerance * scale
+        return {
+            "state": dict(zip(SPECIES, equilibrium)),
+            "vector": equilibrium,
+            "conserved": left.T @ state,
+            "stable": bool(np.all(eigenvalues[nonzero].real < 0)),
+            "feasible": bool(np.all(equilibrium >= -tolerance * max(np.abs(equilibrium).max(), 1.0))),
+        }
+
+    def eigen_report(self, tolerance: float = 1e-10):
+        """
+        Eigenvalues of A with their relaxation (or growth) timescales 1 / |Re| and
+        oscillation periods 2 pi / |Im|, sorted from the slowest to the fastest mode.
+        """
+        eigenvalues, eigenvectors = np.linalg.eig(self.matrix)
+        order = np.argsort(np.abs(eigenvalues.real))
+        scale = max(np.abs(self.matrix).max(), 1.0)
+        report = []
+
+        for index in order:
+            eigenvalue = eigenvalues[index]
+            real = 0.0 if abs(eigenvalue.real) <= tolerance * scale else eigenvalue.real
+            imaginary = 0.0 if abs(eigenvalue.imag) <= tolerance * scale else eigenvalue.imag
+            report.append({
+                "eigenvalue": complex(real, imaginary),
+                "timescale": np.inf if real == 0 else 1 / abs(real),
+                "period": np.inf if imaginary == 0 else 2 * np.pi / abs(imaginary),
+                "behaviour": "conserved" if real == 0 and imaginary == 0 else ("decaying" if real < 0 else ("growing" if real > 0 else "oscillating")),
+                "mode": dict(zip(SPECIES, eigenvectors[:, index])),
+            })
+
+        return report
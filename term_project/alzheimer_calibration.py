@@ -0,0 +1,172 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from alzheimer_model import PARAMS, SPECIES, build_system_matrix, step_matrices
+
+
+def _fit_start(arguments):
+    """
+    Worker entry point, runs one least squares fit from a start point.
+    """
+    calibration, start = arguments
+    return calibration.fit_from(start)
+
+
+class AlzheimerCalibration:
+    """
+    Least squares calibration of AlzheimerModel parameters against observed trajectories.
+    'observations' maps species (e.g. 'NS', 'AB') to (times, values) with times measured
+    on the model's time axis. Parameters are fitted in log space and the gradient of the
+    clamped fixed step simulation is computed exactly with forward sensitivity equations,
+    so every optimizer iteration costs a single model solve.
+    """
+
+    def __init__(self, model, observations: dict, params=None, bounds_factor: float = 1e3):
+        if model.integrator not in ("euler", "rk4"):
+            raise ValueError("Calibration needs a fixed step integrator (euler or rk4)")
+
+        self.model = model
+        self.params = tuple(PARAMS if params is None else params)
+        unknown = set(self.params) - set(PARAMS)
+        if unknown:
+            raise ValueError(f"Parameters {sorted(unknown)} not found in model.")
+        self.indices = np.array([PARAMS.index(name) for name in self.params])
+        self.nominal = model.param_vector()
+        self.initial_state = model.initial_vector.copy()
+        self.steps = int(model.steps)
+        self.log_bounds = (np.log(self.nominal[self.indices] / bounds_factor),
+                           np.log(self.nominal[self.indices] * bounds_factor))
+
+        # Observations as (step index, species index, value, scale) arrays
+        rows = []
+        for species, (times, values) in observations.items():
+            times = np.asarray(times, dtype=float)
+            values = np.asarray(values, dtype=float)
+            steps = np.rint((times - model.start_time) / model.time_step).astype(int)
+            if np.any(steps < 0) or np.any(steps >= self.steps):
+                raise ValueError(f"Observation times of {species} are outside of the simulated horizon")
+            scale = max(np.abs(values).max(), 1e-12)
+            rows.extend((step, SPECIES.index(species), value, scale) for step, value in zip(steps, values))
+        rows.sort()
+        self.observed_steps = np.array([row[0] for row in rows])
+        self.observed_species = np.array([row[1] for row in rows])
+        self.observed_values = np.array([row[2] for row in rows])
+        self.observed_scales = np.array([row[3] for row in rows])
+
+    def _params_from(self, log_params):
+        alfas = self.nominal.copy()
+        alfas[self.indices] = np.exp(log_params)
+        return alfas
+
+    def _step_derivatives(self, alfas):
+        """
+        Derivatives of the step matrix with respect to each fitted parameter, (fitted, 7, 7).
+        The system matrix is linear in the parameters, so dA/dalfa_j is the matrix of the
+        j-th unit vector; for RK4 the Taylor polynomial is differentiated term by term.
+        """
+        time_step = self.model.time_step
+        units = np.eye(len(PARAMS))[self.indices]
+        derivatives = time_step * build_system_matrix(units)
+        if self.model.integrator == "rk4":
+            scaled = time_step * build_system_matrix(alfas)
+            dscaled = derivatives.copy()
+            power, dpower = scaled, dscaled
+            for order in (2, 3, 4):
+                # d(X^k) = dX X^(k - 1) + X d(X^(k - 1))
+                dpower = dscaled @ power + scaled @ dpower
+                power = scaled @ power
+                derivatives = derivatives + dpower / np.prod(range(1, order + 1))
+        return derivatives
+
+    def residuals_and_jacobian(self, log_params):
+        """
+        Scaled residuals of the observations and their exact Jacobian with respect to the log
+        parameters, from one simulation with forward sensitivities
+        S_(k+1) = D_k (M S_k + dM x_k), where D_k masks the populations clamped at zero.
+        """
+        alfas = self._params_from(log_params)
+        step = step_matrices(alfas, self.model.time_step, self.model.integrator)
+        dstep = self._step_derivatives(alfas)
+        # Chain rule for the log parametrization
+        dstep = dstep * alfas[self.indices][:, None, None]
+
+        state = self.initial_state.copy()
+        sensitivity = np.zeros((7, len(self.indices)))
+        residuals = np.empty(len(self.observed_values))
+        jacobian = np.empty((len(self.observed_values), len(self.indices)))
+        observation = 0
+
+        for iteration in range(self.observed_steps[-1] + 1 if len(self.observed_steps) else 0):
+            while observation < len(self.observed_steps) and self.observed_steps[observation] == iteration:
+                species = self.observed_species[observation]
+                scale = self.observed_scales[observation]
+                residuals[observation] = (state[species] - self.observed_values[observation]) / scale
+                jacobian[observation] = sensitivity[species] / scale
+                observation += 1
+
+            raw = step @ state
+            free = raw > 0
+            sensitivity = (step @ sensitivity + (dstep @ state).T) * free[:, None]
+            state = raw * free
+
+        return residuals, jacobian
+
+    def fit_from(self, start, **options):
+        """
+        Run one trust region least squares fit from log parameters 'start'.
+        """
+        from scipy.optimize import least_squares
+
+        cache = {}
+
+        def evaluate(log_params):
+            key = log_params.tobytes()
+            if key not in cache:
+                cache.clear()
+                cache[key] = self.residuals_and_jacobian(log_params)
+            return cache[key]
+
+        solution = least_squares(lambda x: evaluate(x)[0], start, jac=lambda x: evaluate(x)[1],
+                                 bounds=self.log_bounds, method="trf", **options)
+        return {
+            "params": dict(zip(self.params, np.exp(solution.x))),
+            "log_params": solution.x,
+            "cost": solution.cost,
+            "success": solution.success,
+            "model_solves": solution.nfev + solution.njev,
+        }
+
+    def fit(self, starts: int = 1, spread: float = 1.0, seed=None, workers: int = 1):
+        """
+        Multi-start calibration. The first start is the model's current parameters and the
+        others are drawn log-normally around them with standard deviation 'spread' (in log
+        units). Starts run in a process pool when workers > 1. Returns the best fit together
+        with all fits sorted by cost.
+        """
+        rng = np.random.default_rng(seed)
+        nominal = np.log(self.nominal[self.indices])
+        points = nominal + spread * rng.standard_normal((starts, len(self.indices)))
+        points[0] = nominal
+        points = np.clip(points, *self.log_bounds)
+
+        workers = workers or os.cpu_count()
+        if workers == 1 or starts == 1:
+            fits = [self.fit_from(point) for point in points]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                fits = list(executor.map(_fit_start, [(self, point) for point in points]))
+
+        fits.sort(key=lambda fit: fit["cost"])
+        return {"best": fits[0], "fits": fits}
+
+    def calibrated_model(self, fit):
+        """
+        Return a copy of the model with the parameters of a fit.
+        """
+        calibrated = self.model._copy()
+        calibrated.set_state(self.initial_state)
+        for name, value in fit["params"].items():
+            setattr(calibrated, name, value)
+        return calibrated
@@ -1,11 +1,109 @@
+from contextlib import nullcontext
+
 import numpy as np
-import pandas as pd
 import yaml
-from matplotlib import pyplot as plt 
+
+# Order of the species in state vectors and in the columns of the history
+SPECIES = ("NS", "ND", "AQ", "AP", "M1", "M2", "AB")
+SPECIES_LABELS = {
+    "NS": "Neuron survival",
+    "ND": "Neuronal death",
+    "AQ": "Astrocytes quiescent",
+    "AP": "Astrocytes proliferating",
+    "M1": "Microglia M1",
+    "M2": "Microglia M2",
+    "AB": "Amyloid Beta",
+}
+# Names of the parameters in the order of params.yaml
+PARAMS = tuple(f"alfa{index}" for index in range(1, 17)) + ("alfaR",)
+
+
+def build_system_matrix(alfas):
+    """
+    Build the matrix A of the linear system d(state)/dt = A @ state from the 17 parameters
+    (alfa1 ... alfa16, alfaR). A batch of parameter vectors of shape (..., 17) gives
+    a batch of matrices of shape (..., 7, 7).
+    """
+    alfas = np.asarray(alfas, dtype=float)
+    a = [alfas[..., index] for index in range(17)]
+    zero = np.zeros_like(a[0])
+    NS, ND, AQ, AP, M1, M2, AB = range(7)
+    matrix = np.zeros(alfas.shape[:-1] + (7, 7))
+
+    # dNS = alfa1 AQ - alfa2 AP - alfa3 M1 and dND = -dNS
+    dNS = {AQ: a[0], AP: -a[1], M1: -a[2]}
+    # dAQ = alfa4 M2 - alfa5 M1 and dAP = -dAQ
+    dAQ = {M2: a[3], M1: -a[4]}
+    # dM2 = (alfa6 + alfa11) NS - alfa10 ND + (alfa7 + alfa12) AQ - alfa9 M1 + alfa14 M2 - (alfa8 + alfa13) AB and dM1 = -dM2
+    dM2 = {NS: a[5] + a[10], ND: -a[9], AQ: a[6] + a[11], M1: -a[8], M2: a[13], AB: -(a[7] + a[12])}
+    # dAB = alfa15 NS - alfa16 M2 - alfaR AB
+    dAB = {NS: a[14], M2: -a[15], AB: -a[16] + zero}
+
+    for row, negated_row, terms in ((NS, ND, dNS), (AQ, AP, dAQ), (M2, M1, dM2), (AB, None, dAB)):
+        for column, value in terms.items():
+            matrix[..., row, column] = value
+            if negated_row is not None:
+                matrix[..., negated_row, column] = -value
+
+    return matrix
+
+
+def step_matrices(alfas, time_step: float, integrator: str = "euler"):
+    """
+    Build the matrices advancing the state by one fixed step, I + dt A for Euler and the
+    fourth order Taylor polynomial of exp(dt A) for RK4, for parameters of shape (..., 17).
+    """
+    scaled = time_step * build_system_matrix(alfas)
+    step = np.eye(7) + scaled
+    if integrator == "rk4":
+        term = scaled
+        for order in (2, 3, 4):
+            term = term @ scaled / order
+            step = step + term
+    elif integrator != "euler":
+        raise ValueError(f"Fixed step integrator must be euler or rk4, got {integrator}")
+    return step
+
+
+def simulate_batch(alfas, initial_states, steps: int, time_step: float, integrator: str = "euler", return_history: bool = False):
+    """
+    Simulate many parameter vectors (samples, 17) and initial states (samples, 7) at once,
+    advancing the (samples, 7) state tensor with one batched mat-vec per step and the same
+    clamping at zero as AlzheimerModel.simulate. Returns the final states (samples, 7), and
+    with return_history also the (samples, steps, 7) states saved before every step.
+    """
+    alfas = np.asarray(alfas, dtype=float)
+    states = np.asarray(initial_states, dtype=float)
+    samples = np.broadcast_shapes(alfas.shape[:-1], states.shape[:-1])
+    alfas = np.broadcast_to(alfas, samples + (17,))
+    states = np.broadcast_to(states, samples + (7,)).copy()
+    step = step_matrices(alfas, time_step, integrator)
+    history = np.empty(states.shape[:-1] + (steps, 7)) if return_history else None
+
+    for iteration in range(steps):
+        if return_history:
+            history[..., iteration, :] = states
+        states = np.maximum(np.einsum("...ij,...j->...i", step, states), 0)
+
+    return (states, history) if return_history else states
+
 
 class AlzheimerModel:
-    def __init__(self, path_params: str, path_initial_state: str, end_time: float = 20,  start_time: float = 0.0, time_step: float = 0.25):
+    # Available integrators, "euler" and "rk4" take fixed steps of time_step,
+    # "rk45" (embedded Runge-Kutta with error control) and "bdf" (implicit, for
+    # stiff regimes) adapt their step and are interpolated onto the time grid
+    INTEGRATORS = ("euler", "rk4", "rk45", "bdf")
+
+    # Optional instrumentation with phase(name), count(steps), observer and observe(step, state),
+    # e.g. the root instrumentation.Instrumentation. None runs without any instrumentation
+    instrumentation = None
+
+    def __init__(self, path_params: str, path_initial_state: str, end_time: float = 20,  start_time: float = 0.0, time_step: float = 0.25,
+                 integrator: str = "euler", rtol: float = 1e-6, atol: float = 1e-6):
         
+        if integrator not in self.INTEGRATORS:
+            raise ValueError(f"Unknown integrator {integrator}, expected one of {self.INTEGRATORS}")
+
         params = self.load_config(path_params)
         initial_state = self.load_config(path_initial_state)
         
@@ -16,6 +114,11 @@ class AlzheimerModel:
         self.end_time = end_time
         self.time_step = time_step
         self.steps = (self.end_time - start_time) / time_step
+        self.start_time = start_time
+        self.integrator = integrator
+        self.rtol = rtol
+        self.atol = atol
+        self.rhs_evaluations = 0
 
         # initialize the constasnt govering the systems dynamics
         self.initialize_params(params)
@@ -60,115 +163,293 @@ class AlzheimerModel:
         IC6 = Microglia type 2 (M2)
         IC7 = Amyloid beta (AB)
 
-        And then saves them into state transition dicts
+        And then saves them into the state vector
         """
         initial_state = initial_state["values"]
 
-        # initialize the system states
-        self.NS = initial_state[0]
-        self.ND = initial_state[1]
-        self.AQ = initial_state[2]
-        self.AP = initial_state[3]
-        self.M1 = initial_state[4]
-        self.M2 = initial_state[5]
-        self.AB = initial_state[6]
-
-        # initialise the state transition arrays
-        self.states_NS = {}
-        self.states_ND = {}
-        self.states_AQ = {}
-        self.states_AP = {}
-        self.states_M1 = {}
-        self.states_M2 = {}
-        self.states_AB = {}
+        # initialize the system state vector, the species are exposed as attributes (NS, ND, ...)
+        self.state_vector = np.array(initial_state[:7], dtype=float)
+        # every simulation starts from the read-only initial vector
+        self._set_initial(self.state_vector)
+
+        # the history of states is preallocated by simulate as a (steps, 7) array
+        self.history = None
 
     def save_state(self, iteration):
-        self.states_NS[iteration] = self.NS
-        self.states_ND[iteration] = self.ND
-        self.states_AQ[iteration] = self.AQ
-        self.states_AP[iteration] = self.AP
-        self.states_M1[iteration] = self.M1
-        self.states_M2[iteration] = self.M2
-        self.states_AB[iteration] = self.AB
+        self.history[iteration] = self.state_vector
 
-    def update(self):
+    def get_state(self):
         """
-        Update the model state based on the current parameters and conditions.
+        Return a copy of the current state vector in the order NS, ND, AQ, AP, M1, M2, AB.
         """
-        dNS = (self.alfa1 * self.AQ - self.alfa2 * self.AP - self.alfa3 * self.M1) 
+        return self.state_vector.copy()
 
-        dND = - dNS
+    def set_state(self, state):
+        """
+        Set the current state from a vector in the order NS, ND, AQ, AP, M1, M2, AB.
+        The next simulation starts from this state.
+        """
+        self.state_vector[:] = state
+        self._set_initial(self.state_vector)
 
-        dAQ = (self.alfa4 * self.M2 - self.alfa5 * self.M1) 
+    def _set_initial(self, state):
+        """
+        Store a read-only copy of the state simulations start from.
+        """
+        self.initial_vector = np.array(state, dtype=float)
+        self.initial_vector.flags.writeable = False
 
-        dAP = -dAQ
+    def param_vector(self):
+        """
+        Return the current parameters as a vector in the order alfa1 ... alfa16, alfaR.
+        """
+        return np.array([getattr(self, name) for name in PARAMS], dtype=float)
 
-        dM2 = ((self.alfa6 + self.alfa11) * self.NS
-            - self.alfa10 * self.ND
-            + (self.alfa7 + self.alfa12) * self.AQ
-            - self.alfa9 * self.M1
-            + self.alfa14 * self.M2
-            - (self.alfa8 + self.alfa13) * self.AB)
-        
-        dM1 = - dM2 
+    def system_matrix(self):
+        """
+        Return the matrix A of d(state)/dt = A @ state for the current parameters.
+        """
+        return build_system_matrix(self.param_vector())
 
-        dAB = (self.alfa15 * self.NS
-            - self.alfa16 * self.M2
-            - self.alfaR * self.AB)
-        
+    def step_matrix(self):
+        """
+        Return the matrix advancing the state by one fixed time step before clamping,
+        I + dt A for Euler and the fourth order Taylor polynomial of exp(dt A) for RK4,
+        which is exactly what one classic Runge-Kutta step computes for a linear system.
+        """
+        return step_matrices(self.param_vector(), self.time_step, self.integrator)
 
-        # Update each population (Euler method)
-        self.NS = max(0, self.NS + dNS * self.time_step)
-        self.ND = max(0, self.ND + dND * self.time_step)
-        self.AQ = max(0, self.AQ + dAQ * self.time_step)
-        self.AP = max(0, self.AP + dAP * self.time_step)
-        self.M2 = max(0, self.M2 + dM2 * self.time_step)
-        self.M1 = max(0, self.M1 + dM1 * self.time_step)
-        self.AB = max(0, self.AB + dAB * self.time_step)
+    def derivatives(self, state):
+        """
+        Right-hand side of the system for a state vector (NS, ND, AQ, AP, M1, M2, AB).
+        """
+        return self.system_matrix() @ state
 
+    def update(self):
+        """
+        Update the model state based on the current parameters and conditions.
+        """
+        self.rhs_evaluations += 4 if self.integrator == "rk4" else 1
+        # Update each population (Euler or RK4 step), populations are clamped at zero
+        np.maximum(self.step_matrix() @ self.state_vector, 0, out=self.state_vector)
+
+    def _phase(self, name: str):
+        """
+        Context timing a phase of the run when instrumentation is attached.
+        """
+        return self.instrumentation.phase(name) if self.instrumentation is not None else nullcontext()
+
+    def _observer(self):
+        """
+        observe(step, state) of the attached instrumentation, None when nothing observes,
+        so the stepping loops decide once per run whether to sample states.
+        """
+        if self.instrumentation is None or self.instrumentation.observer is None:
+            return None
+        return self.instrumentation.observe
 
     def simulate(self):
         """
-        Simulates the time evolution of the system, each time the t-1 state is saved 
+        Simulates the time evolution of the system, each time the t-1 state is saved.
+        The observer of the attached instrumentation receives the states of the history while
+        they are computed, block by block for the fixed step integrators and segment by segment
+        between clamping events for the adaptive ones.
         """
-        for iteration in range(int(self.steps)):
-            self.save_state(iteration)
-            self.update()
+        self.rhs_evaluations = 0
+        steps = int(self.steps)
+        self.state_vector[:] = self.initial_vector
+        if self.integrator in ("rk45", "bdf"):
+            with self._phase("setup"):
+                self.history = np.empty((steps, 7))
+            with self._phase("stepping"):
+                self.simulate_adaptive()
+        else:
+            with self._phase("setup"):
+                trajectory = np.empty((steps + 1, 7))
+                trajectory[0] = self.state_vector
+                step = self.step_matrix()
+            with self._phase("stepping"):
+                self._step_blocks(step, trajectory, observe=self._observer())
+            self.history = trajectory[:steps]
+            self.state_vector[:] = trajectory[steps]
+            self.rhs_evaluations = steps * (4 if self.integrator == "rk4" else 1)
+
+        if self.instrumentation is not None:
+            self.instrumentation.count(steps)
+
+    def _step_blocks(self, step, trajectory, block_size=256, observe=None):
+        """
+        Fills trajectory[1:] from trajectory[0] with clamped steps x -> max(0, step @ x).
+        While the set of clamped populations does not change, a clamped step is the linear map
+        P @ step where P zeroes the clamped populations, so whole blocks of steps are computed
+        at once from the precomputed powers of P @ step. The block is accepted up to the first
+        step whose clamping pattern differs, and the next block starts from there.
+        observe(step, state) receives every row but the last as soon as its block is accepted.
+        """
+        powers_by_pattern = {}
+        filled = 0
+        last = len(trajectory) - 1
+        if observe is not None and last > 0:
+            observe(0, trajectory[0])
+
+        while filled < last:
+            state = trajectory[filled]
+            clamped = step @ state < 0
+            key = clamped.tobytes()
+            if key not in powers_by_pattern:
+                projected = step * ~clamped[:, None]
+                powers = np.empty((block_size, 7, 7))
+                powers[0] = projected
+                for power in range(1, block_size):
+                    np.dot(projected, powers[power - 1], out=powers[power])
+                powers_by_pattern[key] = powers
+            powers = powers_by_pattern[key]
+
+            count = min(block_size, last - filled)
+            candidates = powers[:count] @ state
+            # Unclamped values of every step of the block, computed from its previous state
+            raw = np.vstack((state, candidates[:-1])) @ step.T
+            consistent = np.all((raw < 0) == clamped, axis=1)
+            accepted = count if consistent.all() else int(np.argmin(consistent))
+
+            np.maximum(candidates[:accepted], 0, out=trajectory[filled + 1:filled + 1 + accepted])
+            if observe is not None:
+                for row in range(filled + 1, min(filled + accepted + 1, last)):
+                    observe(row, trajectory[row])
+            filled += accepted
+
+    def simulate_adaptive(self):
+        """
+        Integrates the system with an adaptive integrator and interpolates the dense output
+        onto the time grid of the fixed step integrators. The non-negativity clamp is handled
+        with events: a population reaching zero while still decreasing is pinned at zero
+        (its derivative is removed from the system) until its derivative turns positive again.
+        """
+        from scipy.integrate import solve_ivp
+
+        method = {"rk45": "RK45", "bdf": "BDF"}[self.integrator]
+        steps = int(self.steps)
+        times = self.start_time + self.time_step * np.arange(steps + 1)
+        results = np.empty((steps + 1, 7))
+        results[0] = self.get_state()
+        filled = 1
+        observe = self._observer()
+        if observe is not None and steps > 0:
+            observe(0, results[0])
+        time, state = times[0], results[0].copy()
+        # The system is linear, its Jacobian is the constant system matrix
+        matrix = self.system_matrix()
+        pinned = (state <= 0) & (matrix @ state < 0)
+
+        while filled < len(times):
+            events = []
+            for species in range(7):
+                if pinned[species]:
+                    # Released when the unclamped derivative becomes positive
+                    event = lambda t, y, species=species: matrix[species] @ y
+                    event.direction = 1
+                else:
+                    event = lambda t, y, species=species: y[species]
+                    event.direction = -1
+                event.terminal = True
+                events.append(event)
+
+            free = ~pinned
+            rhs = lambda t, y, free=free: (matrix @ y) * free
+            options = {"jac": matrix * free[:, None]} if method == "BDF" else {}
+            solution = solve_ivp(rhs, (time, times[-1]), state, method=method, dense_output=True,
+                                 events=events, rtol=self.rtol, atol=self.atol, **options)
+            self.rhs_evaluations += solution.nfev
+            if solution.status == -1:
+                raise RuntimeError(f"Integration failed: {solution.message}")
+
+            end = times[-1] if solution.status == 0 else solution.t[-1]
+            reached = filled + int(np.searchsorted(times[filled:], end, side="right"))
+            if reached > filled:
+                results[filled:reached] = np.maximum(0, solution.sol(times[filled:reached])).T
+                if observe is not None:
+                    for row in range(filled, min(reached, steps)):
+                        observe(row, results[row])
+            filled = reached
+
+            time, state = end, np.maximum(0, solution.y[:, -1])
+            for species, event_times in enumerate(solution.t_events):
+                if len(event_times):
+                    if pinned[species]:
+                        pinned[species] = False
+                    else:
+                        state[species] = 0
+                        pinned[species] = matrix[species] @ state < 0
+
+        self.history[:] = results[:steps]
+        self.state_vector[:] = results[steps]
 
     def load_config(self, path):
         with open(path, 'r') as file:
             data = yaml.safe_load(file)     
             return data
         
+    def _cache_key_parts(self):
+        """
+        Configuration identifying a run for a result cache: parameters, initial state, time grid and integrator.
+        """
+        return [self.param_vector(), self.initial_vector, self.start_time, self.time_step, int(self.steps),
+                self.integrator, self.rtol, self.atol]
+
+    def _cache_arrays(self):
+        """
+        Results of the last simulation stored by a result cache.
+        """
+        return {"history": self.history, "state": self.state_vector}
+
+    def _cache_restore(self, arrays):
+        """
+        Restore results stored by a result cache as if simulate had run.
+        """
+        self.history = arrays["history"]
+        self.state_vector[:] = arrays["state"]
+
+    def trajectory(self, species: str):
+        """
+        Return the simulated trajectory of a species (e.g. 'NS', 'M1') as a view into the history.
+        """
+        if self.history is None:
+            raise RuntimeError("The model must be simulated prior to reading results")
+        return self.history[:, SPECIES.index(species)]
+
     def show_results(self):
-        return {
-        "Neuron survival": self.states_NS,
-        "Neuronal death": self.states_ND,
-        "Astrocytes quiescent": self.states_AQ,
-        "Astrocytes proliferating": self.states_AP,
-        "Microglia M1": self.states_M1,
-        "Microglia M2": self.states_M2,
-        "Amyloid Beta": self.states_AB
-        }
+        return {SPECIES_LABELS[species]: self.trajectory(species) for species in SPECIES}
 
 
     def plot_scatter(self):
-        population_NS = self.states_NS
-        population_M1 = self.states_M1
-        population_AB = self.states_AB
+        from matplotlib import pyplot as plt
+
+        with self._phase("plotting"):
+            iterations = np.arange(len(self.history))
 
-        plt.scatter(population_NS.keys(), population_NS.values(), color='red', label='NS')
+            plt.scatter(iterations, self.trajectory("NS"), color='red', label='NS')
         
-        plt.scatter(population_M1.keys(), population_M1.values(), color='blue', label='M1')
+            plt.scatter(iterations, self.trajectory("M1"), color='blue', label='M1')
         
-        plt.scatter(population_AB.keys(), population_AB.values(), color='black', label='AB')
+            plt.scatter(iterations, self.trajectory("AB"), color='black', label='AB')
 
-        plt.xlabel('Time Steps')
-        plt.ylabel('Population')
-        plt.title('Scatter Plot of Populations Over Time')
-        plt.legend()
-        plt.tight_layout()
-        plt.show()
+            plt.xlabel('Time Steps')
+            plt.ylabel('Population')
+            plt.title('Scatter Plot of Populations Over Time')
+            plt.legend()
+            plt.tight_layout()
+            plt.show()
+
+
+    def _copy(self):
+        """
+        Copy of the model with its own state vector and no simulated history.
+        """
+        copied = AlzheimerModel.__new__(AlzheimerModel)
+        copied.__dict__ = self.__dict__.copy()
+        copied.state_vector = self.state_vector.copy()
+        copied.history = None
+        return copied
 
 
     def perturb_param(self, param_name: str, factor: float = 2.0):
@@ -176,10 +457,9 @@ class AlzheimerModel:
         Perturb a single parameter (e.g., 'alfa3') by multiplying it with a factor.
         Returns a new AlzheimerModel instance with the perturbed parameter.
         """
-        perturbed = AlzheimerModel.__new__(AlzheimerModel)
-        perturbed.__dict__ = self.__dict__.copy() 
+        perturbed = self._copy()
 
-        if hasattr(perturbed, param_name):
+        if param_name in PARAMS:
             setattr(perturbed, param_name, getattr(perturbed, param_name) * factor)
         else:
             raise ValueError(f"Parameter {param_name} not found in model.")
@@ -192,30 +472,56 @@ class AlzheimerModel:
         Perturb initial condition of a species (e.g., 'NS', 'M1') by a factor.
         Returns a new AlzheimerModel instance with perturbed initial state.
         """
-        perturbed = AlzheimerModel.__new__(AlzheimerModel)
-        perturbed.__dict__ = self.__dict__.copy()
+        perturbed = self._copy()
 
-        if hasattr(perturbed, species):
-            setattr(perturbed, species, getattr(perturbed, species) * factor)
+        if species in SPECIES:
+            initial = self.initial_vector.copy()
+            initial[SPECIES.index(species)] *= factor
+            perturbed.set_state(initial)
         else:
             raise ValueError(f"Species {species} not found in model.")
 
         return perturbed
 
 
-    def compare_runs(self, models: dict, variable: str):
+    def compare_runs(self, models: dict, variable: str, cache=None):
         """
         Compare trajectories of a given variable across multiple model runs.
         'models' should be a dict: {"label": model_instance, ...}
+        With a result cache (e.g. result_cache.Result_Cache) runs of identical
+        configurations are restored instead of simulated again.
         """
+        from matplotlib import pyplot as plt
+
         for label, model in models.items():
-            model.simulate()
-            data = getattr(model, f"states_{variable}")
-            plt.plot(data.keys(), data.values(), label=label)
+            if cache is not None:
+                cache.call(model, "simulate")
+            else:
+                model.simulate()
+            data = model.trajectory(variable)
+            plt.plot(np.arange(len(data)), data, label=label)
 
         plt.xlabel('Time Steps')
         plt.ylabel(variable)
         plt.title(f'Comparison of {variable} under Perturbations')
         plt.legend()
         plt.tight_layout()
-        plt.show()
\ No newline at end of file
+        plt.show()
+
+
+def _set_species(model, index, value):
+    initial = model.initial_vector.copy()
+    initial[index] = value
+    model.state_vector[index] = value
+    model._set_initial(initial)
+
+
+def _species_property(index):
+    return property(lambda self: self.state_vector[index],
+                    lambda self, value: _set_species(self, index, value))
+
+
+# Species attributes (model.NS, model.M1, ...) read the state vector, writing one
+# also changes the initial state of the next simulation
+for _index, _species in enumerate(SPECIES):
+    setattr(AlzheimerModel, _species, _species_property(_index))
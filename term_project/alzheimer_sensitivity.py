@@ -0,0 +1,126 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from alzheimer_model import PARAMS, SPECIES, simulate_batch
+
+
+def _simulate_chunk(arguments):
+    """
+    Worker entry point, simulates one chunk of parameter and initial state vectors.
+    """
+    alfas, initial_states, steps, time_step, integrator = arguments
+    return simulate_batch(alfas, initial_states, steps, time_step, integrator)
+
+
+class AlzheimerSensitivity:
+    """
+    Global sensitivity analysis of an AlzheimerModel over the 17 alfa parameters and
+    (optionally) the 7 initial conditions. Every factor varies log-uniformly between
+    nominal / spread and nominal * spread. All samples of a design are simulated in one
+    batched run (optionally split across a process pool) and the outputs are the final
+    values of the seven species.
+    """
+
+    def __init__(self, model, spread: float = 2.0, include_initial: bool = True, seed=None, workers: int = 1):
+        if model.integrator not in ("euler", "rk4"):
+            raise ValueError("Sensitivity analysis needs a fixed step integrator (euler or rk4)")
+
+        self.model = model
+        self.spread = spread
+        self.include_initial = include_initial
+        self.workers = workers or os.cpu_count()
+        self.rng = np.random.default_rng(seed)
+
+        self.factors = PARAMS + (SPECIES if include_initial else ())
+        self.nominal = np.concatenate([model.param_vector(), model.initial_vector if include_initial else []])
+
+    def _to_factors(self, unit_samples):
+        """
+        Map samples from the unit hypercube to factor values.
+        """
+        return self.nominal * self.spread ** (2 * unit_samples - 1)
+
+    def evaluate(self, unit_samples):
+        """
+        Simulate the model for samples from the unit hypercube (samples, factors) and
+        return the final states (samples, 7).
+        """
+        values = self._to_factors(unit_samples)
+        alfas = values[:, :17]
+        initial_states = values[:, 17:] if self.include_initial else self.model.initial_vector
+        steps = int(self.model.steps)
+
+        if self.workers == 1 or len(values) < 2 * self.workers:
+            return simulate_batch(alfas, initial_states, steps, self.model.time_step, self.model.integrator)
+
+        initial_states = np.broadcast_to(initial_states, (len(values), 7))
+        chunks = np.array_split(np.arange(len(values)), self.workers)
+        jobs = [(alfas[chunk], initial_states[chunk], steps, self.model.time_step, self.model.integrator) for chunk in chunks]
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            return np.concatenate(list(executor.map(_simulate_chunk, jobs)))
+
+    def sobol(self, samples: int = 1024):
+        """
+        First order and total Sobol indices from a Saltelli design of samples * (factors + 2)
+        model runs, with the Saltelli (2010) first order and Jansen total effect estimators.
+        Returns {"factors", "outputs", "S1", "ST"} with (7, factors) index arrays.
+        """
+        dimension = len(self.factors)
+        A = self.rng.random((samples, dimension))
+        B = self.rng.random((samples, dimension))
+        # AB[i] is A with the column of factor i taken from B
+        AB = np.repeat(A[None], dimension, axis=0)
+        AB[np.arange(dimension), :, np.arange(dimension)] = B.T
+
+        outputs = self.evaluate(np.concatenate([A, B, AB.reshape(-1, dimension)]))
+        f_A = outputs[:samples]
+        f_B = outputs[samples:2 * samples]
+        f_AB = outputs[2 * samples:].reshape(dimension, samples, 7)
+
+        variance = np.var(np.concatenate([f_A, f_B]), axis=0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            first_order = np.mean(f_B[None] * (f_AB - f_A[None]), axis=1) / variance
+            total = 0.5 * np.mean((f_A[None] - f_AB) ** 2, axis=1) / variance
+
+        return {"factors": self.factors, "outputs": SPECIES, "S1": first_order.T, "ST": total.T}
+
+    def morris(self, trajectories: int = 50, levels: int = 4):
+        """
+        Morris elementary effects screening from 'trajectories' one-at-a-time trajectories on
+        a grid of 'levels' levels, (factors + 1) runs each. Returns {"factors", "outputs",
+        "mu", "mu_star", "sigma"} with (7, factors) arrays, effects are per unit of the
+        scaled factor range.
+        """
+        dimension = len(self.factors)
+        delta = levels / (2 * (levels - 1))
+        base_levels = np.arange(levels) / (levels - 1)
+        base_levels = base_levels[base_levels + delta <= 1 + 1e-12]
+
+        base = self.rng.choice(base_levels, size=(trajectories, dimension))
+        directions = self.rng.choice([-1.0, 1.0], size=(trajectories, dimension))
+        orders = np.argsort(self.rng.random((trajectories, dimension)), axis=1)
+
+        # Factors moving down start from the upper level
+        points = np.empty((trajectories, dimension + 1, dimension))
+        points[:, 0] = base + delta * (directions < 0)
+        rows = np.arange(trajectories)
+        for step in range(dimension):
+            points[:, step + 1] = points[:, step]
+            moved = orders[:, step]
+            points[rows, step + 1, moved] += delta * directions[rows, moved]
+
+        outputs = self.evaluate(points.reshape(-1, dimension)).reshape(trajectories, dimension + 1, 7)
+        effects = np.empty((trajectories, dimension, 7))
+        for step in range(dimension):
+            moved = orders[:, step]
+            effects[rows, moved] = (outputs[:, step + 1] - outputs[:, step]) / (delta * directions[rows, moved])[:, None]
+
+        return {
+            "factors": self.factors,
+            "outputs": SPECIES,
+            "mu": effects.mean(axis=0).T,
+            "mu_star": np.abs(effects).mean(axis=0).T,
+            "sigma": effects.std(axis=0, ddof=1).T,
+        }